@@ -0,0 +1,193 @@
+"""Compara el modo plano con el cifrado por páginas (SQLCipher) en las consultas
+de periodo del dashboard.
+
+    python bench_cifrado.py [movimientos] [repeticiones]
+
+Genera un libro sintético en un directorio temporal, lo guarda plano y cifrado,
+y mide: abrir una conexión como `_conectar` (base principal con `archivo` e
+`instantaneas` adjuntas), consultar un mes con la caché de páginas fría y
+consultar meses con la caché caliente. El cifrado se mide con la frase en cada
+base (una derivación por base) y con la clave cruda que deriva `main` una vez
+por proceso. No importa `main` porque al importarlo arranca la app; las
+consultas son las mismas de `consultar_dashboard`.
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import datetime
+import hashlib
+
+CLAVE = "clave-de-prueba"
+ITERACIONES_CLAVE = 256_000
+# Cada sesión de la app abre dos conexiones: `conn` y `conn_lectura`
+CONEXIONES_SESION = 2
+
+ESQUEMA = """
+    CREATE TABLE movimientos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo TEXT NOT NULL,
+        descripcion TEXT NOT NULL,
+        valor INTEGER NOT NULL,
+        fecha_full TEXT NOT NULL,
+        fecha_corta TEXT,
+        timestamp INTEGER NOT NULL,
+        categoria TEXT,
+        recurrente_id INTEGER,
+        moneda TEXT NOT NULL DEFAULT 'COP'
+    );
+    CREATE INDEX idx_timestamp ON movimientos(timestamp);
+"""
+
+SQL_LISTA = """
+    SELECT id, tipo, descripcion, valor, fecha_full, categoria, moneda, timestamp
+    FROM movimientos WHERE timestamp >= ? AND timestamp < ?
+    ORDER BY timestamp DESC
+"""
+
+SQL_TOTALES = """
+    SELECT tipo, COALESCE(categoria,'OTROS'), moneda, CASE WHEN moneda = 'COP' THEN '' ELSE fecha_full END, SUM(valor)
+    FROM movimientos WHERE timestamp >= ? AND timestamp < ?
+    GROUP BY 1, 2, 3, 4
+"""
+
+CATEGORIAS = ("COMIDA", "TRANSPORTE", "VIVIENDA", "SALUD", "OCIO", "SERVICIOS", "OTROS")
+
+
+def _meses(n_anios: int):
+    hoy = datetime.date.today()
+    meses = []
+    for i in range(n_anios * 12):
+        anio, mes = divmod(hoy.year * 12 + hoy.month - 1 - i, 12)
+        desde = datetime.datetime(anio, mes + 1, 1)
+        hasta = datetime.datetime(anio + (mes + 1) // 12, (mes + 1) % 12 + 1, 1)
+        meses.append((int(desde.timestamp()), int(hasta.timestamp())))
+    return meses
+
+
+def _filas(n: int, meses):
+    azar = random.Random(7)
+    inicio, fin = meses[-1][0], meses[0][1]
+    for _ in range(n):
+        ts = azar.randrange(inicio, fin)
+        fecha = datetime.datetime.fromtimestamp(ts)
+        tipo = "INGRESO" if azar.random() < 0.15 else "GASTO"
+        yield (tipo, f"Movimiento {azar.randrange(10**6)}", azar.randrange(1000, 5_000_000),
+               fecha.strftime("%Y-%m-%d"), fecha.strftime("%d/%m"), ts,
+               azar.choice(CATEGORIAS), "USD" if azar.random() < 0.05 else "COP")
+
+
+def _clave_cruda(clave: str, sal: bytes) -> str:
+    derivada = hashlib.pbkdf2_hmac("sha512", clave.encode("utf-8"), sal, ITERACIONES_CLAVE, 32)
+    return f"x'{derivada.hex()}'"
+
+
+def _rutas(directorio: str, nombre: str):
+    base = os.path.join(directorio, nombre.replace(" ", "_"))
+    return base + ".db", base + "_archivo.db", base + "_cache.db"
+
+
+def _abrir(modulo, rutas, clave):
+    """Igual que `_conectar`: principal en WAL y las otras dos bases adjuntas con su KEY."""
+    principal, archivo, instantaneas = rutas
+    conn = modulo.connect(principal)
+    if clave:
+        conn.execute(f'PRAGMA key = "{clave}"')
+    adjuntar = "ATTACH DATABASE ? AS {} KEY ?" if clave else "ATTACH DATABASE ? AS {}"
+    extra = (clave,) if clave else ()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(adjuntar.format("instantaneas"), (instantaneas,) + extra)
+    conn.execute("PRAGMA instantaneas.journal_mode=WAL")
+    conn.execute(adjuntar.format("archivo"), (archivo,) + extra)
+    return conn
+
+
+def _crear(modulo, rutas, clave, n: int, meses):
+    conn = _abrir(modulo, rutas, clave)
+    conn.executescript(ESQUEMA)
+    conn.execute("CREATE TABLE instantaneas.periodos (libro TEXT, periodo TEXT, version INTEGER, datos TEXT)")
+    conn.execute("CREATE TABLE archivo.movimientos (id INTEGER PRIMARY KEY, valor INTEGER, timestamp INTEGER)")
+    with conn:
+        conn.executemany("""
+            INSERT INTO movimientos (tipo, descripcion, valor, fecha_full, fecha_corta, timestamp, categoria, moneda)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, _filas(n, meses))
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def _periodo(conn, desde: int, hasta: int):
+    conn.execute(SQL_LISTA, (desde, hasta)).fetchall()
+    conn.execute(SQL_TOTALES, (desde, hasta)).fetchall()
+
+
+def _medir(modulo, rutas, clave, meses, repeticiones: int) -> dict:
+    aperturas, frias, calientes = [], [], []
+    azar = random.Random(11)
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        conn = _abrir(modulo, rutas, clave)
+        # Leer el esquema de las tres bases obliga a descifrar (y derivar) cada una
+        for esquema in ("main", "archivo", "instantaneas"):
+            conn.execute(f"SELECT count(*) FROM {esquema}.sqlite_master").fetchone()
+        t1 = time.perf_counter()
+        _periodo(conn, *meses[0])
+        t2 = time.perf_counter()
+        aperturas.append(t1 - t0)
+        frias.append(t2 - t1)
+        for desde, hasta in azar.sample(meses, min(12, len(meses))):
+            t = time.perf_counter()
+            _periodo(conn, desde, hasta)
+            calientes.append(time.perf_counter() - t)
+        conn.close()
+    return {"apertura": statistics.median(aperturas), "mes_frio": statistics.median(frias),
+            "mes_caliente": statistics.median(calientes)}
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    try:
+        from sqlcipher3 import dbapi2 as sqlcipher
+    except ImportError:
+        sqlcipher = None
+        print("sqlcipher3 no está instalado: sólo se mide el modo plano")
+
+    meses = _meses(5)
+    modos = [("plano", sqlite3, None)]
+    derivacion = None
+    if sqlcipher is not None:
+        t = time.perf_counter()
+        cruda = _clave_cruda(CLAVE, os.urandom(16))
+        derivacion = time.perf_counter() - t
+        # El mismo motor sin clave aísla el costo del cifrado del de la versión de SQLite
+        modos += [("sqlcipher sin clave", sqlcipher, None), ("cifrado frase", sqlcipher, CLAVE),
+                  ("cifrado", sqlcipher, cruda)]
+
+    with tempfile.TemporaryDirectory() as directorio:
+        resultados = {}
+        for nombre, modulo, clave in modos:
+            rutas = _rutas(directorio, nombre)
+            _crear(modulo, rutas, clave, n, meses)
+            resultados[nombre] = _medir(modulo, rutas, clave, meses, repeticiones)
+            resultados[nombre]["tamano"] = os.path.getsize(rutas[0])
+
+    print(f"{n} movimientos en {len(meses)} meses, {repeticiones} repeticiones (medianas)")
+    print(f"{'modo':<22}{'apertura ms':>14}{'sesión ms':>12}{'mes frío ms':>14}{'mes caliente ms':>18}{'tamaño KB':>12}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<22}{r['apertura'] * 1000:>14.2f}{r['apertura'] * CONEXIONES_SESION * 1000:>12.2f}"
+              f"{r['mes_frio'] * 1000:>14.2f}{r['mes_caliente'] * 1000:>18.3f}{r['tamano'] / 1024:>12.0f}")
+    if derivacion is not None:
+        print(f"derivación de la clave cruda (una vez por proceso): {derivacion * 1000:.0f} ms")
+        cifrado = resultados["cifrado"]
+        for referencia in ("plano", "sqlcipher sin clave"):
+            base = resultados[referencia]
+            print(f"cifrado frente a {referencia}: mes caliente x{cifrado['mes_caliente'] / base['mes_caliente']:.2f}, "
+                  f"mes frío x{cifrado['mes_frio'] / base['mes_frio']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
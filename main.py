@@ -2,7 +2,21 @@ import flet as ft
 import sqlite3
 import datetime
 import time
+import threading
+import uuid
 import math
+import os
+import hashlib
+import csv
+import json
+import logging
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import compress
 from typing import Dict, List, Tuple, Optional
 
 # =========================================================
@@ -47,15 +61,15 @@ class MotorIA:
         if ingresos == 0 and gastos == 0:
             return "Aún no has registrado movimientos. Comienza agregando tus ingresos y gastos."
         if balance > 0:
-            return f"🌟 Balance positivo de ${balance:,.0f}. Tus ingresos son ${ingresos:,.0f} y tus gastos ${gastos:,.0f}."
+            return f"🌟 Balance positivo de {_fmt_money(balance)}. Tus ingresos son {_fmt_money(ingresos)} y tus gastos {_fmt_money(gastos)}."
         else:
-            return f"⚠️ Tus gastos (${gastos:,.0f}) superan tus ingresos (${ingresos:,.0f}) por ${abs(balance):,.0f}."
+            return f"⚠️ Tus gastos ({_fmt_money(gastos)}) superan tus ingresos ({_fmt_money(ingresos)}) por {_fmt_money(abs(balance))}."
     
     @staticmethod
     def generar_comparacion_mes_anterior(ing_act: float, gas_act: float, ing_ant: float, gas_ant: float) -> str:
         if ing_ant == 0 and gas_ant == 0:
             if ing_act > 0 or gas_act > 0:
-                return f"🎉 Mejora del 100%. Este mes: ingresos ${ing_act:,.0f}, gastos ${gas_act:,.0f}"
+                return f"🎉 Mejora del 100%. Este mes: ingresos {_fmt_money(ing_act)}, gastos {_fmt_money(gas_act)}"
             return "Sin datos del mes anterior"
         
         var_ing = ((ing_act - ing_ant) / ing_ant * 100) if ing_ant > 0 else 0
@@ -66,24 +80,25 @@ class MotorIA:
         if balance_act > balance_ant: emoji = "📈"
         else: emoji = "📉"
         
-        return f"{emoji} Ingresos: {var_ing:+.0f}%, Gastos: {var_gas:+.0f}%, Balance: ${balance_act:,.0f} vs ${balance_ant:,.0f}"
+        return f"{emoji} Ingresos: {var_ing:+.0f}%, Gastos: {var_gas:+.0f}%, Balance: {_fmt_money(balance_act)} vs {_fmt_money(balance_ant)}"
     
     @staticmethod
-    def generar_alertas_personalizadas(ingresos: float, gastos: float, ahorros: float, deudas: float, metas_ahorro: List) -> List[str]:
+    def generar_alertas_personalizadas(ingresos: float, gastos: float, ahorros: float, deudas: float, metas_ahorro: List,
+                                       alertas_presupuesto: Optional[List[str]] = None) -> List[str]:
         alertas = []
         if ahorros == 0 and ingresos > 0:
             alertas.append("No estás ahorrando nada actualmente")
         if gastos > ingresos and ingresos > 0:
-            alertas.append(f"Gastas ${gastos - ingresos:,.0f} más de lo que ganas")
+            alertas.append(f"Gastas {_fmt_money(gastos - ingresos)} más de lo que ganas")
         if ingresos > 0 and deudas > ingresos * 0.4:
-            alertas.append(f"Tus deudas (${deudas:,.0f}) superan el 40% de tus ingresos")
-        return alertas[:3]
+            alertas.append(f"Tus deudas ({_fmt_money(deudas)}) superan el 40% de tus ingresos")
+        return (alertas_presupuesto or []) + alertas[:3]
     
     @staticmethod
     def analizar_categorias_gastos(categorias: Dict, total_gastos: float) -> List[Dict]:
         if not categorias or total_gastos == 0: return []
         analisis = []
-        for i, (cat, monto) in enumerate(sorted(categorias.items(), key=lambda x: x[1], reverse=True)[:5], 1):
+        for i, (cat, monto) in enumerate(heapq.nlargest(5, categorias.items(), key=lambda x: x[1]), 1):
             porcentaje = (monto / total_gastos * 100)
             insight = "Gasto esencial - optimiza con compras inteligentes" if cat in ["ALIMENTACION", "ALIMENTACIÓN"] else "Revisa si puedes reducir este gasto"
             analisis.append({"categoria": cat, "monto": monto, "porcentaje": porcentaje, "insight": insight, "es_principal": i == 1})
@@ -94,7 +109,7 @@ class MotorIA:
         consejos = []
         if ahorros == 0 and ingresos > 0:
             consejos.append("🪙 Crea un fondo de emergencia (3-6 meses de gastos)")
-            consejos.append(f"🎯 Meta: ahorra ${ingresos * 0.1:,.0f} el próximo mes")
+            consejos.append(f"🎯 Meta: ahorra {_fmt_money(ingresos * 0.1)} el próximo mes")
         if gastos > ingresos:
             consejos.append("📉 Prioriza gastos esenciales")
         consejos.append("📊 Revisa tus finanzas semanalmente")
@@ -102,17 +117,1261 @@ class MotorIA:
         return list(dict.fromkeys(consejos))[:5]
     
     @staticmethod
-    def generar_meta_proximo_mes(ingresos: float, gastos: float, ahorros: float) -> str:
+    def generar_meta_proximo_mes(ingresos: float, gastos: float, ahorros: float,
+                                 proyeccion: Optional[List[Dict]] = None) -> str:
         if ingresos == 0: return "Registra tus primeros ingresos"
+        if proyeccion and proyeccion[0]["neto"] > 0:
+            return f"Según tu tendencia puedes ahorrar {_fmt_money(proyeccion[0]['neto'])} el próximo mes"
         balance = ingresos - gastos
         if balance <= 0: return "Reduce tus gastos para tener balance positivo"
-        if ahorros == 0: return f"Ahorra ${ingresos * 0.1:,.0f} (10% de tus ingresos) el próximo mes"
-        return f"Incrementa tu ahorro a ${ahorros * 1.2:,.0f} el próximo mes"
+        if ahorros == 0: return f"Ahorra {_fmt_money(ingresos * 0.1)} (10% de tus ingresos) el próximo mes"
+        return f"Incrementa tu ahorro a {_fmt_money(ahorros * 1.2)} el próximo mes"
 
 
-def _fmt_money(n: float) -> str:
-    try: return f"${n:,.0f}"
-    except: return "$0"
+# =========================================================
+# DINERO EN CENTAVOS
+# =========================================================
+# Todos los montos se guardan y suman como enteros en centavos
+def _a_centavos(texto: str) -> int:
+    try:
+        monto = Decimal(texto.replace(",", "").strip())
+    except InvalidOperation:
+        raise ValueError(texto)
+    if not monto.is_finite(): raise ValueError(texto)
+    return int((monto * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def _ahorros_centavos(conn: sqlite3.Connection) -> int:
+    """Total ahorrado en centavos; `ahorros.ahorrado_actual` se guarda en pesos."""
+    return int(conn.execute("SELECT ROUND(COALESCE(SUM(ahorrado_actual),0) * 100) FROM ahorros").fetchone()[0] or 0)
+
+
+MONEDA_BASE = "COP"
+SIMBOLOS_MONEDA = {"COP": "$", "USD": "US$", "EUR": "€"}
+
+
+@lru_cache(maxsize=4096)
+def _fmt_money(centavos: int, moneda: str = MONEDA_BASE) -> str:
+    """Centavos a unidades enteras con separador de miles: 123456 -> "$1,235"."""
+    centavos = round(centavos or 0)
+    pesos, resto = divmod(abs(centavos), 100)
+    if resto >= 50: pesos += 1
+    simbolo = SIMBOLOS_MONEDA.get(moneda, f"{moneda} ")
+    return f"{simbolo}{'-' if centavos < 0 and pesos else ''}{pesos:,}"
+
+
+def _migrar_a_centavos(conn: sqlite3.Connection):
+    """Convierte en sitio las columnas de dinero REAL de bases anteriores a enteros en centavos.
+
+    SQLite no cambia el tipo de una columna, así que cada tabla se reconstruye;
+    sus índices y triggers se vuelven a crear después con el resto del esquema.
+    """
+    tablas = {
+        "movimientos": ("valor", """
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            descripcion TEXT NOT NULL,
+            valor INTEGER NOT NULL,
+            fecha_full TEXT NOT NULL,
+            fecha_corta TEXT,
+            timestamp INTEGER NOT NULL,
+            categoria TEXT,
+            recurrente_id INTEGER
+        """),
+        "recurrentes": ("valor", """
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            descripcion TEXT NOT NULL,
+            valor INTEGER NOT NULL,
+            categoria TEXT,
+            frecuencia TEXT NOT NULL,
+            intervalo_dias INTEGER,
+            inicio TEXT NOT NULL,
+            activo INTEGER NOT NULL DEFAULT 1
+        """),
+        "presupuestos": ("limite", """
+            categoria TEXT PRIMARY KEY,
+            limite INTEGER NOT NULL
+        """),
+    }
+    pendientes = []
+    for tabla, (columna, definicion) in tablas.items():
+        tipos = {c[1]: c[2].upper() for c in conn.execute(f"PRAGMA table_info({tabla})")}
+        if tipos.get(columna) == "REAL":
+            pendientes.append((tabla, columna, definicion, list(tipos)))
+    if not pendientes: return
+    
+    with conn:
+        for tabla, columna, definicion, columnas in pendientes:
+            lista = ", ".join(columnas)
+            origen = ", ".join(f"CAST(ROUND({c} * 100) AS INTEGER)" if c == columna else c for c in columnas)
+            conn.execute(f"CREATE TABLE {tabla}_centavos ({definicion})")
+            conn.execute(f"INSERT INTO {tabla}_centavos ({lista}) SELECT {origen} FROM {tabla}")
+            conn.execute(f"DROP TABLE {tabla}")
+            conn.execute(f"ALTER TABLE {tabla}_centavos RENAME TO {tabla}")
+        # Las estadísticas y versiones quedan en otra unidad: se recalculan
+        conn.execute("DROP TABLE IF EXISTS estadisticas_categoria")
+        conn.execute("UPDATE versiones_periodo SET version = version + 1")
+
+
+# =========================================================
+# MONEDAS Y TASAS DE CAMBIO
+# =========================================================
+RUTA_TASAS = "tasas_cambio.csv"
+
+# Tasa vigente de una moneda en una fecha: la última publicada en o antes de ese día
+# (1 para MONEDA_BASE). Sin tasa publicada da NULL y el movimiento queda fuera de
+# totales y estadísticas, igual que en ConversorMonedas; el archivo espera a que haya tasa.
+SQL_TASA = """(CASE WHEN {fila}.moneda = '""" + MONEDA_BASE + """' THEN 1.0 ELSE
+               (SELECT tasa FROM tasas_cambio
+                WHERE moneda = {fila}.moneda AND fecha <= {fila}.fecha_full
+                ORDER BY fecha DESC LIMIT 1) END)"""
+
+
+def reconstruir_estadisticas(conn: sqlite3.Connection):
+    """Recalcula `estadisticas_categoria` con las tasas actuales, incluido lo archivado.
+
+    Los triggers suman y restan cada movimiento con la tasa vigente en ese momento;
+    si las tasas cambian hay que recalcular en la misma transacción, o un borrado
+    posterior restaría un monto distinto del que se sumó.
+    """
+    conn.execute("DELETE FROM estadisticas_categoria")
+    conn.execute(f"""
+        INSERT INTO estadisticas_categoria (categoria, n, suma, suma_cuadrados)
+        SELECT COALESCE(categoria,'OTROS'), COUNT(*), SUM(base), TOTAL(CAST(base AS REAL)*base)
+        FROM (SELECT categoria, CAST(ROUND(valor * {SQL_TASA.format(fila="m")}) AS INTEGER) AS base
+              FROM (SELECT categoria, valor, moneda, fecha_full FROM movimientos WHERE tipo = 'GASTO'
+                    UNION ALL
+                    SELECT categoria, valor, moneda, fecha_full FROM archivo.movimientos WHERE tipo = 'GASTO') m)
+        WHERE base IS NOT NULL
+        GROUP BY COALESCE(categoria,'OTROS')
+    """)
+
+
+def cargar_tasas(conn: sqlite3.Connection, ruta: str = RUTA_TASAS) -> bool:
+    """Carga `tasas_cambio` desde un CSV local (fecha,moneda,tasa) si el archivo cambió.
+
+    `tasa` son unidades de MONEDA_BASE por unidad de `moneda`. Devuelve True si recargó.
+    """
+    if not os.path.exists(ruta): return False
+    firma = str(os.path.getmtime(ruta))
+    fila = conn.execute("SELECT valor FROM mantenimiento WHERE clave = 'tasas_firma'").fetchone()
+    if fila and fila[0] == firma: return False
+    
+    tasas, invalidas = [], 0
+    try:
+        with open(ruta, newline="", encoding="utf-8") as f:
+            for r in csv.DictReader(f):
+                try:
+                    moneda, fecha = r["moneda"].strip().upper(), r["fecha"].strip()
+                    tasa = float(r["tasa"])
+                    datetime.date.fromisoformat(fecha)
+                    if not moneda or not math.isfinite(tasa) or tasa <= 0: raise ValueError(tasa)
+                except (KeyError, AttributeError, TypeError, ValueError):
+                    invalidas += 1
+                    continue
+                tasas.append((moneda, fecha, tasa))
+    except (OSError, UnicodeDecodeError, csv.Error):
+        logging.exception("No se pudo leer %s", ruta)
+        return False
+    if invalidas:
+        logging.warning("%s: %d filas inválidas ignoradas", ruta, invalidas)
+    if not tasas and invalidas:
+        # Un archivo sin ninguna fila válida no borra las tasas que ya había
+        return False
+    with conn:
+        conn.execute("DELETE FROM tasas_cambio")
+        conn.executemany("INSERT OR REPLACE INTO tasas_cambio (moneda, fecha, tasa) VALUES (?, ?, ?)", tasas)
+        conn.execute("""
+            INSERT INTO mantenimiento (clave, valor) VALUES ('tasas_firma', ?)
+            ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor
+        """, (firma,))
+        # Cambian los montos convertidos de todos los periodos
+        conn.execute("UPDATE versiones_periodo SET version = version + 1")
+        reconstruir_estadisticas(conn)
+    return True
+
+
+class ConversorMonedas:
+    """Convierte montos a MONEDA_BASE con la tasa vigente de cada día.
+
+    Las tasas se leen una vez en columnas ordenadas por fecha; cada consulta
+    (moneda, día) se resuelve por búsqueda binaria y queda en caché. `firma` es
+    la de `cargar_tasas` con que se leyeron; `recargar` las vuelve a leer.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.faltantes = set()
+        self.recargar(conn)
+
+    @staticmethod
+    def leer_firma(conn: sqlite3.Connection) -> Optional[str]:
+        fila = conn.execute("SELECT valor FROM mantenimiento WHERE clave = 'tasas_firma'").fetchone()
+        return fila[0] if fila else None
+
+    def recargar(self, conn: sqlite3.Connection):
+        # Si otro proceso recarga las tasas durante la lectura, se vuelve a leer
+        while True:
+            firma = self.leer_firma(conn)
+            fechas: Dict[str, List[str]] = {}
+            tasas: Dict[str, array] = {}
+            for moneda, fecha, tasa in conn.execute("SELECT moneda, fecha, tasa FROM tasas_cambio ORDER BY moneda, fecha"):
+                fechas.setdefault(moneda, []).append(fecha)
+                tasas.setdefault(moneda, array("d")).append(tasa)
+            if self.leer_firma(conn) == firma:
+                break
+        self._fechas, self._tasas, self.firma = fechas, tasas, firma
+        self.tasa = lru_cache(maxsize=8192)(self._tasa)
+
+    @property
+    def monedas(self) -> List[str]:
+        return [MONEDA_BASE] + sorted(m for m in self._fechas if m != MONEDA_BASE)
+
+    def _tasa(self, moneda: str, fecha: str) -> Optional[float]:
+        if moneda == MONEDA_BASE: return 1.0
+        fechas = self._fechas.get(moneda)
+        i = bisect_right(fechas, fecha) if fechas else 0
+        if not i:
+            self.faltantes.add(moneda)
+            return None
+        return self._tasas[moneda][i - 1]
+
+    def convertir(self, centavos: int, moneda: str, fecha: str) -> int:
+        """Monto en MONEDA_BASE; sin tasa queda fuera (0), como en SQL_TASA."""
+        tasa = self.tasa(moneda, fecha)
+        return round(centavos * tasa) if tasa is not None else 0
+
+    def sumar(self, grupos) -> Dict:
+        """Suma en MONEDA_BASE filas agregadas (clave, moneda, fecha, total).
+
+        Las consultas agrupan por moneda y día (la moneda base sin día), así
+        que se convierte una vez por grupo y nunca por movimiento.
+        """
+        sumas: Dict = {}
+        for clave, moneda, fecha, total in grupos:
+            sumas[clave] = sumas.get(clave, 0) + self.convertir(total, moneda, fecha)
+        return sumas
+
+
+# =========================================================
+# MOVIMIENTOS RECURRENTES
+# =========================================================
+FRECUENCIAS_RECURRENTES = ("MENSUAL", "QUINCENAL", "DIAS")
+
+
+def _ultimo_dia_mes(anio: int, mes: int) -> datetime.date:
+    siguiente = datetime.date(anio + 1, 1, 1) if mes == 12 else datetime.date(anio, mes + 1, 1)
+    return siguiente - datetime.timedelta(days=1)
+
+
+def _fechas_recurrencia(frecuencia: str, inicio: datetime.date, intervalo: Optional[int],
+                        desde: datetime.date, hasta: datetime.date) -> List[datetime.date]:
+    """Fechas de una regla que caen en [desde, hasta], nunca antes de su inicio."""
+    desde = max(desde, inicio)
+    if desde > hasta: return []
+    if frecuencia == "MENSUAL":
+        fechas = []
+        anio, mes = desde.year, desde.month
+        while datetime.date(anio, mes, 1) <= hasta:
+            fecha = datetime.date(anio, mes, min(inicio.day, _ultimo_dia_mes(anio, mes).day))
+            if desde <= fecha <= hasta: fechas.append(fecha)
+            anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+        return fechas
+    paso = 14 if frecuencia == "QUINCENAL" else intervalo
+    if not paso or paso <= 0: return []
+    k = -(-(desde - inicio).days // paso)
+    fecha = inicio + datetime.timedelta(days=k * paso)
+    fechas = []
+    while fecha <= hasta:
+        fechas.append(fecha)
+        fecha += datetime.timedelta(days=paso)
+    return fechas
+
+
+SQL_REGLAS_ACTIVAS = """
+    SELECT id, tipo, descripcion, valor, categoria, frecuencia, intervalo_dias, inicio, moneda
+    FROM recurrentes WHERE activo = 1
+"""
+SQL_INSERTAR_OCURRENCIA = """
+    INSERT OR IGNORE INTO movimientos
+    (tipo, descripcion, valor, fecha_full, fecha_corta, timestamp, categoria, recurrente_id, moneda)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _ocurrencias(reglas, desde: datetime.date, hasta: datetime.date) -> List[Tuple]:
+    """Filas de `movimientos` para las ocurrencias de `reglas` en [desde, hasta]."""
+    filas = []
+    for rid, tipo, desc, valor, cat, frecuencia, intervalo, inicio, moneda in reglas:
+        for fecha in _fechas_recurrencia(frecuencia, datetime.date.fromisoformat(inicio), intervalo, desde, hasta):
+            momento = datetime.datetime(fecha.year, fecha.month, fecha.day)
+            filas.append((tipo, desc, valor, fecha.isoformat(), fecha.strftime("%d/%m"),
+                          int(momento.timestamp()), cat, rid, moneda))
+    return filas
+
+
+def materializar_recurrentes(conn: sqlite3.Connection, anio: str, mes: str,
+                             hoy: Optional[datetime.date] = None) -> int:
+    """Inserta en bloque las ocurrencias pendientes de las reglas recurrentes del periodo.
+
+    `periodos_recurrentes` recuerda hasta qué fecha se materializó cada periodo, así que
+    una vista repetida no hace más que una consulta. Las filas generadas llevan
+    `recurrente_id` y el índice único (recurrente_id, fecha_full) descarta duplicados
+    si dos ejecuciones se solapan. Devuelve el número de movimientos insertados.
+    """
+    hoy = hoy or datetime.date.today()
+    inicio_mes = datetime.date(int(anio), int(mes), 1)
+    hasta = min(_ultimo_dia_mes(int(anio), int(mes)), hoy)
+    if hasta < inicio_mes: return 0
+    
+    periodo = f"{anio}-{mes}"
+    fila = conn.execute("SELECT hasta FROM periodos_recurrentes WHERE periodo = ?", (periodo,)).fetchone()
+    if fila and fila[0] >= hasta.isoformat(): return 0
+    desde = datetime.date.fromisoformat(fila[0]) + datetime.timedelta(days=1) if fila else inicio_mes
+    
+    filas = _ocurrencias(conn.execute(SQL_REGLAS_ACTIVAS), desde, hasta)
+    
+    with conn:
+        insertadas = conn.executemany(SQL_INSERTAR_OCURRENCIA, filas).rowcount if filas else 0
+        conn.execute("""
+            INSERT INTO periodos_recurrentes (periodo, hasta) VALUES (?, ?)
+            ON CONFLICT(periodo) DO UPDATE SET hasta = excluded.hasta
+        """, (periodo, hasta.isoformat()))
+    return max(insertadas, 0)
+
+
+def materializar_regla(conn: sqlite3.Connection, rid: int) -> int:
+    """Pone al día una regla nueva en los periodos ya materializados.
+
+    Sólo inserta las ocurrencias de esa regla: reabrir los periodos volvería a
+    crear las de todas las reglas, incluidas las que el usuario ya borró.
+    """
+    reglas = conn.execute(SQL_REGLAS_ACTIVAS + " AND id = ?", (rid,)).fetchall()
+    if not reglas: return 0
+    filas = []
+    for periodo, hasta in conn.execute("SELECT periodo, hasta FROM periodos_recurrentes WHERE hasta >= ?",
+                                       (reglas[0][7],)).fetchall():
+        inicio_mes = datetime.date(int(periodo[:4]), int(periodo[5:7]), 1)
+        filas += _ocurrencias(reglas, inicio_mes, datetime.date.fromisoformat(hasta))
+    if not filas: return 0
+    with conn:
+        return max(conn.executemany(SQL_INSERTAR_OCURRENCIA, filas).rowcount, 0)
+
+
+def pausar_recurrente(conn: sqlite3.Connection, rid: int) -> bool:
+    """Deja de generar una regla; lo ya materializado queda como está."""
+    with conn:
+        return conn.execute("UPDATE recurrentes SET activo = 0 WHERE id = ? AND activo = 1", (rid,)).rowcount > 0
+
+
+# =========================================================
+# PRESUPUESTOS POR CATEGORÍA
+# =========================================================
+class ControlPresupuestos:
+    """Límites mensuales por categoría contra el gasto acumulado de cada mes.
+
+    El acumulado de un mes se guarda con la versión de su periodo
+    (`versiones_periodo`) y se mantiene con `registrar`/`revertir`, que se llaman
+    con el movimiento ya confirmado: si desde la carga sólo cambió ese movimiento
+    (la versión subió en uno) se ajusta en memoria; si escribió otra sesión o
+    worker, se vuelve a sumar el mes, que ya lo incluye. Los límites se releen en
+    cada uso, así que los definidos en otra sesión también cuentan.
+    """
+    UMBRALES = ((1.0, "🚨 {cat}: superaste el presupuesto ({gasto} de {limite})"),
+                (0.8, "⚠️ {cat}: llevas el 80% del presupuesto ({gasto} de {limite})"))
+
+    def __init__(self, conn: sqlite3.Connection, conversor: "ConversorMonedas"):
+        self.conn = conn
+        self.conversor = conversor
+        self.limites: Dict[str, int] = {}
+        self._acumulado: Dict[str, Tuple[int, Dict[str, int]]] = {}
+        self._cargar_limites()
+
+    def _cargar_limites(self) -> Dict[str, int]:
+        self.limites = dict(self.conn.execute("SELECT categoria, limite FROM presupuestos"))
+        return self.limites
+
+    def definir(self, categoria: str, limite: int):
+        with self.conn:
+            self.conn.execute("""
+                INSERT INTO presupuestos (categoria, limite) VALUES (?, ?)
+                ON CONFLICT(categoria) DO UPDATE SET limite = excluded.limite
+            """, (categoria, limite))
+        self.limites[categoria] = limite
+
+    def _version(self, periodo: str) -> int:
+        fila = self.conn.execute("SELECT version FROM versiones_periodo WHERE periodo = ?", (periodo,)).fetchone()
+        return fila[0] if fila else 0
+
+    def _gastos_mes(self, anio: str, mes: str) -> Dict[str, int]:
+        periodo = f"{anio}-{mes}"
+        version = self._version(periodo)
+        cache = self._acumulado.get(periodo)
+        if cache and cache[0] == version:
+            return cache[1]
+        while True:
+            gastos = self.conversor.sumar(self.conn.execute("""
+                SELECT COALESCE(categoria,'OTROS'), moneda, CASE WHEN moneda = ? THEN '' ELSE fecha_full END, SUM(valor)
+                FROM movimientos
+                WHERE tipo = 'GASTO' AND timestamp >= ? AND timestamp < ?
+                GROUP BY 1, 2, 3
+            """, (MONEDA_BASE, *_limites_mes(int(anio), int(mes)))))
+            # Una escritura durante la suma la dejaría con una versión que no le corresponde
+            despues = self._version(periodo)
+            if despues == version: break
+            version = despues
+        self._acumulado[periodo] = (version, gastos)
+        return gastos
+
+    def invalidar(self, anio: str, mes: str):
+        self._acumulado.pop(f"{anio}-{mes}", None)
+
+    def _mensaje(self, cat: str, gasto: int, umbral: float) -> str:
+        texto = dict(self.UMBRALES)[umbral]
+        return texto.format(cat=cat, gasto=_fmt_money(gasto), limite=_fmt_money(self.limites[cat]))
+
+    def _ajustar(self, anio: str, mes: str, categoria: str, valor: int) -> Tuple[int, int]:
+        """Aplica un alta (+) o baja (-) ya confirmada y devuelve el acumulado antes y después."""
+        periodo = f"{anio}-{mes}"
+        cache = self._acumulado.get(periodo)
+        version = self._version(periodo)
+        if cache and cache[0] == version - 1:
+            gastos = cache[1]
+            antes = gastos.get(categoria, 0)
+            gastos[categoria] = antes + valor
+            self._acumulado[periodo] = (version, gastos)
+            return antes, antes + valor
+        despues = self._gastos_mes(anio, mes).get(categoria, 0)
+        return despues - valor, despues
+
+    def registrar(self, anio: str, mes: str, categoria: str, valor: int) -> Optional[str]:
+        """Suma un gasto al acumulado y devuelve la alerta si cruzó un umbral."""
+        antes, despues = self._ajustar(anio, mes, categoria, valor)
+        limite = self._cargar_limites().get(categoria)
+        if not limite: return None
+        for umbral, _ in self.UMBRALES:
+            if antes < limite * umbral <= despues:
+                return self._mensaje(categoria, despues, umbral)
+        return None
+
+    def revertir(self, anio: str, mes: str, categoria: str, valor: int):
+        self._ajustar(anio, mes, categoria, -valor)
+
+    def alertas(self, anio: str, mes: str) -> List[str]:
+        if not self._cargar_limites(): return []
+        gastos = self._gastos_mes(anio, mes)
+        alertas = []
+        for cat, limite in self.limites.items():
+            gasto = gastos.get(cat, 0)
+            for umbral, _ in self.UMBRALES:
+                if limite > 0 and gasto >= limite * umbral:
+                    alertas.append(self._mensaje(cat, gasto, umbral))
+                    break
+        return alertas
+
+
+# =========================================================
+# DETECCIÓN DE ANOMALÍAS
+# =========================================================
+class DetectorAnomalias:
+    """Señala gastos atípicos, cargos duplicados y picos de gasto del día.
+
+    Usa `estadisticas_categoria` (n, suma y suma de cuadrados por categoría), que los
+    triggers de `movimientos` actualizan en O(1) en cada alta y baja, así que revisar
+    un movimiento nunca recorre el historial.
+    """
+    MIN_MUESTRAS = 5
+    DESVIACIONES = 3
+    FACTOR_PICO = 4
+    # Piso de la desviación como fracción de la media: con cargos idénticos la
+    # varianza es cero y cualquier centavo de más superaría el umbral
+    DESVIACION_MINIMA = 0.1
+    VENTANA_DUPLICADO = 48 * 3600
+
+    def __init__(self, conn: sqlite3.Connection, conversor: "ConversorMonedas"):
+        self.conn = conn
+        self.conversor = conversor
+        self._dia: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def _media_desviacion(cls, n: int, suma: float, suma_cuadrados: float) -> Tuple[float, float]:
+        media = suma / n
+        varianza = max(0.0, (suma_cuadrados - suma * media) / (n - 1)) if n > 1 else 0.0
+        return media, max(math.sqrt(varianza), cls.DESVIACION_MINIMA * abs(media))
+
+    def _umbral(self, categoria: str) -> Optional[Tuple[float, float]]:
+        fila = self.conn.execute(
+            "SELECT n, suma, suma_cuadrados FROM estadisticas_categoria WHERE categoria = ?", (categoria,)
+        ).fetchone()
+        if not fila or fila[0] < self.MIN_MUESTRAS: return None
+        media, desviacion = self._media_desviacion(*fila)
+        return media, media + self.DESVIACIONES * desviacion
+
+    def _gastos_dia(self, fecha: datetime.date) -> Dict[str, int]:
+        clave = fecha.isoformat()
+        if clave not in self._dia:
+            inicio = int(datetime.datetime(fecha.year, fecha.month, fecha.day).timestamp())
+            self._dia = {clave: self.conversor.sumar(self.conn.execute("""
+                SELECT COALESCE(categoria,'OTROS'), moneda, fecha_full, SUM(valor) FROM movimientos
+                WHERE tipo = 'GASTO' AND timestamp >= ? AND timestamp < ?
+                GROUP BY 1, 2, 3
+            """, (inicio, inicio + 86400)))}
+        return self._dia[clave]
+
+    def invalidar(self):
+        self._dia = {}
+
+    def revisar(self, tipo: str, descripcion: str, valor: int, categoria: str,
+                momento: datetime.datetime, moneda: str = MONEDA_BASE) -> List[str]:
+        """Avisos para un gasto que se va a registrar, comparado con el historial previo."""
+        if tipo != "GASTO": return []
+        avisos = []
+        ts = int(momento.timestamp())
+        if self.conn.execute("""
+            SELECT 1 FROM movimientos
+            WHERE descripcion = ? AND valor = ? AND timestamp >= ? AND moneda = ? LIMIT 1
+        """, (descripcion, valor, ts - self.VENTANA_DUPLICADO, moneda)).fetchone():
+            avisos.append(f"🔁 Posible cargo duplicado: {descripcion} por {_fmt_money(valor, moneda)}")
+        
+        valor = self.conversor.convertir(valor, moneda, momento.strftime("%Y-%m-%d"))
+        umbral = self._umbral(categoria)
+        gastos_dia = self._gastos_dia(momento.date())
+        total_dia = gastos_dia.get(categoria, 0) + valor
+        if umbral:
+            media, limite = umbral
+            if valor > limite:
+                avisos.append(f"💥 {categoria}: {_fmt_money(valor)} es muy superior a lo habitual ({_fmt_money(media)})")
+            elif total_dia > max(limite, self.FACTOR_PICO * media):
+                avisos.append(f"📈 Pico de gasto hoy en {categoria}: {_fmt_money(total_dia)}")
+        return avisos
+
+    def registrar(self, valor: int, categoria: str, momento: datetime.datetime):
+        gastos_dia = self._gastos_dia(momento.date())
+        gastos_dia[categoria] = gastos_dia.get(categoria, 0) + valor
+
+    def anomalias_periodo(self, libro: "LibroColumnar", anio: str, mes: str, limite: int = 5) -> List[str]:
+        """Gastos atípicos y cargos repetidos de un mes."""
+        estadisticas = {c: self._media_desviacion(n, s, sc) for c, n, s, sc in self.conn.execute(
+            "SELECT categoria, n, suma, suma_cuadrados FROM estadisticas_categoria WHERE n >= ?",
+            (self.MIN_MUESTRAS,)
+        )}
+        avisos = []
+        i, j = libro.rango_mes(anio, mes)
+        for ts, tipo, codigo, valor, resumen in zip(libro.timestamps[i:j], libro.tipos[i:j], libro.categorias[i:j],
+                                                    libro.valores[i:j], libro.resumenes[i:j]):
+            # Un total mensual archivado no es comparable con un gasto suelto
+            if tipo != TIPO_GASTO or resumen: continue
+            cat = libro.nombres_categoria[codigo]
+            if cat in estadisticas:
+                media, desviacion = estadisticas[cat]
+                if valor > media + self.DESVIACIONES * desviacion:
+                    fecha = datetime.datetime.fromtimestamp(ts).strftime("%d/%m")
+                    avisos.append(f"💥 {fecha} {cat}: {_fmt_money(valor)} (habitual {_fmt_money(media)})")
+        for desc, valor, moneda, fecha, veces in self.conn.execute("""
+            SELECT descripcion, valor, moneda, fecha_full, COUNT(*) FROM movimientos
+            WHERE tipo = 'GASTO' AND timestamp >= ? AND timestamp < ?
+            GROUP BY descripcion, valor, moneda, fecha_full HAVING COUNT(*) > 1
+        """, _limites_mes(int(anio), int(mes))):
+            avisos.append(f"🔁 {desc} cobrado {veces} veces el {fecha[8:10]}/{fecha[5:7]} ({_fmt_money(valor, moneda)})")
+        return avisos[:limite]
+
+
+# =========================================================
+# LIBRO COLUMNAR (HISTORIAL EN MEMORIA PARA ANÁLISIS)
+# =========================================================
+TIPO_GASTO, TIPO_INGRESO = 0, 1
+
+
+def _limites_mes(anio: int, mes: int) -> Tuple[int, int]:
+    inicio = datetime.datetime(anio, mes, 1)
+    fin = datetime.datetime(anio + 1, 1, 1) if mes == 12 else datetime.datetime(anio, mes + 1, 1)
+    return int(inicio.timestamp()), int(fin.timestamp())
+
+
+def _limites_dia(anio: str, mes: str, dia: str) -> Tuple[int, int]:
+    try:
+        inicio = datetime.datetime(int(anio), int(mes), int(dia))
+    except ValueError:
+        return 0, 0
+    return int(inicio.timestamp()), int((inicio + datetime.timedelta(days=1)).timestamp())
+
+
+class LibroColumnar:
+    """Historial completo de `movimientos` en columnas compactas, ordenado por timestamp.
+
+    Los valores son centavos enteros de MONEDA_BASE (array "q"), así que las sumas son exactas.
+    Las categorías se guardan codificadas como enteros pequeños contra un diccionario
+    y el tipo como bandera (TIPO_INGRESO / TIPO_GASTO), sin repetir cadenas por fila.
+    Las filas de `resumen_archivado` son totales mensuales, no movimientos, y
+    quedan marcadas en `resumenes` para que los análisis por movimiento las salten.
+    """
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.valores = array("q")
+        self.tipos = array("b")
+        self.categorias = array("I")
+        self.resumenes = array("b")
+        self.nombres_categoria: List[str] = []
+        self._codigos: Dict[str, int] = {}
+        # Versión de cada periodo con la que se leyó el libro
+        self.versiones: Dict[str, int] = {}
+
+    @staticmethod
+    def leer_versiones(conn: sqlite3.Connection) -> Dict[str, int]:
+        return dict(conn.execute("SELECT periodo, version FROM versiones_periodo"))
+
+    @classmethod
+    def cargar(cls, conn: sqlite3.Connection, conversor: "ConversorMonedas") -> "LibroColumnar":
+        """Lee todo el historial convertido a MONEDA_BASE.
+
+        Si otra conexión escribe durante la lectura se vuelve a leer; tras varios
+        intentos queda la versión previa, y la próxima comparación lo recarga.
+        """
+        for _ in range(3):
+            versiones = cls.leer_versiones(conn)
+            libro = cls._leer(conn, conversor)
+            if cls.leer_versiones(conn) == versiones:
+                break
+        libro.versiones = versiones
+        return libro
+
+    @classmethod
+    def _leer(cls, conn: sqlite3.Connection, conversor: "ConversorMonedas") -> "LibroColumnar":
+        libro = cls()
+        # Los años archivados entran como un total por mes, tipo y categoría
+        for periodo, tipo, cat, total in conn.execute(
+            "SELECT periodo, tipo, categoria, total FROM resumen_archivado ORDER BY periodo"
+        ):
+            libro.agregar(_limites_mes(int(periodo[:4]), int(periodo[5:7]))[0], tipo, total, cat, resumen=True)
+        # Se itera el cursor directamente: una sola pasada sin fetchall()
+        for ts, tipo, valor, cat, moneda, fecha in conn.execute(
+            "SELECT timestamp, tipo, valor, categoria, moneda, fecha_full FROM movimientos ORDER BY timestamp"
+        ):
+            if moneda != MONEDA_BASE:
+                valor = conversor.convertir(valor, moneda, fecha)
+            libro.agregar(ts, tipo, valor, cat)
+        return libro
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def _codigo(self, categoria: Optional[str]) -> int:
+        categoria = categoria or "OTROS"
+        codigo = self._codigos.get(categoria)
+        if codigo is None:
+            codigo = self._codigos[categoria] = len(self.nombres_categoria)
+            self.nombres_categoria.append(categoria)
+        return codigo
+
+    def agregar(self, timestamp: int, tipo: str, valor: int, categoria: Optional[str], resumen: bool = False):
+        bandera = TIPO_INGRESO if tipo == "INGRESO" else TIPO_GASTO
+        codigo = self._codigo(categoria)
+        if not self.timestamps or timestamp >= self.timestamps[-1]:
+            i = len(self.timestamps)
+        else:
+            i = bisect_left(self.timestamps, timestamp)
+        self.timestamps.insert(i, timestamp)
+        self.valores.insert(i, valor)
+        self.tipos.insert(i, bandera)
+        self.categorias.insert(i, codigo)
+        self.resumenes.insert(i, resumen)
+
+    def rango(self, desde: int, hasta: int) -> Tuple[int, int]:
+        """Índices [i, j) de los movimientos con desde <= timestamp < hasta."""
+        return bisect_left(self.timestamps, desde), bisect_left(self.timestamps, hasta)
+
+    def rango_mes(self, anio: str, mes: str) -> Tuple[int, int]:
+        return self.rango(*_limites_mes(int(anio), int(mes)))
+
+    def totales(self, i: int, j: int) -> Tuple[int, int]:
+        valores = self.valores[i:j]
+        ingresos = sum(compress(valores, self.tipos[i:j]))
+        return ingresos, sum(valores) - ingresos
+
+    def gastos_por_categoria(self, i: int, j: int) -> Dict[str, int]:
+        sumas: Dict[int, int] = {}
+        for tipo, codigo, valor in zip(self.tipos[i:j], self.categorias[i:j], self.valores[i:j]):
+            if tipo == TIPO_GASTO:
+                sumas[codigo] = sumas.get(codigo, 0) + valor
+        return {self.nombres_categoria[c]: v for c, v in sumas.items()}
+
+
+# =========================================================
+# PRONÓSTICOS
+# =========================================================
+def _sumar_meses(periodo: str, n: int) -> str:
+    total = int(periodo[:4]) * 12 + int(periodo[5:7]) - 1 + n
+    return f"{total // 12}-{str(total % 12 + 1).zfill(2)}"
+
+
+class MotorPronostico:
+    """Cierre de mes y proyección de ahorro sobre agregados mensuales.
+
+    Los totales de cada mes se guardan junto a la versión de su periodo
+    (`versiones_periodo`, mantenida por triggers) y sólo se vuelven a sumar los
+    meses cuya versión cambió. Los resultados se cachean con la misma versión.
+    """
+
+    def __init__(self):
+        self._mensual: Dict[str, Tuple[int, int, int]] = {}
+        self._cache_cierre: Dict[str, Tuple[Tuple, Optional[Dict]]] = {}
+        self._cache_proyeccion: Dict[Tuple[str, int], Tuple[int, List[Dict]]] = {}
+        self.version_libro = 0
+
+    def sincronizar(self, libro: "LibroColumnar"):
+        # Las versiones son las del libro, no las actuales: así nunca se guardan
+        # totales viejos bajo una versión nueva
+        versiones = libro.versiones
+        for periodo in [p for p in self._mensual if p not in versiones]:
+            del self._mensual[periodo]
+        for periodo, version in versiones.items():
+            if self._mensual.get(periodo, (None,))[0] != version:
+                self._mensual[periodo] = (version, *libro.totales(*libro.rango_mes(periodo[:4], periodo[5:7])))
+        # Las versiones sólo crecen, así que su suma cambia con cualquier escritura
+        self.version_libro = sum(versiones.values())
+
+    def _serie(self, hasta: str) -> Tuple[List[str], List[float], List[float]]:
+        """Meses anteriores a `hasta`, contiguos (los huecos cuentan como cero)."""
+        periodos = sorted(p for p in self._mensual if p < hasta)
+        if not periodos: return [], [], []
+        serie = [periodos[0]]
+        while serie[-1] < periodos[-1]:
+            serie.append(_sumar_meses(serie[-1], 1))
+        vacio = (0, 0.0, 0.0)
+        return (serie, [self._mensual.get(p, vacio)[1] for p in serie],
+                [self._mensual.get(p, vacio)[2] for p in serie])
+
+    @staticmethod
+    def _ajustar(valores: List[float], meses: List[int], horizonte: int) -> List[float]:
+        """Nivel + tendencia lineal + estacionalidad aditiva por mes del año."""
+        n = len(valores)
+        if n == 0: return [0.0] * horizonte
+        media = sum(valores) / n
+        estacional = [0.0] * 12
+        if n >= 12:
+            sumas, cuentas = [0.0] * 12, [0] * 12
+            for v, m in zip(valores, meses):
+                sumas[m] += v
+                cuentas[m] += 1
+            estacional = [sumas[m] / cuentas[m] - media if cuentas[m] else 0.0 for m in range(12)]
+        desest = [v - estacional[m] for v, m in zip(valores, meses)]
+        
+        ventana = desest[-12:]
+        k = len(ventana)
+        pendiente = 0.0
+        if k >= 3:
+            x_med, y_med = (k - 1) / 2, sum(ventana) / k
+            pendiente = (sum((x - x_med) * (y - y_med) for x, y in enumerate(ventana))
+                         / sum((x - x_med) ** 2 for x in range(k)))
+        recientes = desest[-3:]
+        nivel = sum(recientes) / len(recientes)
+        # El nivel es el promedio de los últimos 3 meses, centrado un mes antes del último
+        centro = (len(recientes) - 1) / 2
+        ultimo = meses[-1]
+        return [max(0.0, nivel + pendiente * (h + centro) + estacional[(ultimo + h) % 12])
+                for h in range(1, horizonte + 1)]
+
+    def proyeccion(self, base: str, horizonte: int = 12) -> List[Dict]:
+        """Meses siguientes a `base` estimados con el historial completo anterior a `base`."""
+        clave = (base, horizonte)
+        cache = self._cache_proyeccion.get(clave)
+        if cache and cache[0] == self.version_libro: return cache[1]
+        
+        periodos, ingresos, gastos = self._serie(base)
+        resultado = []
+        if periodos:
+            meses = [int(p[5:7]) - 1 for p in periodos]
+            # Desde el último mes cerrado hasta base+horizonte
+            pasos = horizonte + (int(base[:4]) * 12 + int(base[5:7])) - (int(periodos[-1][:4]) * 12 + int(periodos[-1][5:7]))
+            ing_fut = self._ajustar(ingresos, meses, pasos)[-horizonte:]
+            gas_fut = self._ajustar(gastos, meses, pasos)[-horizonte:]
+            acumulado = 0.0
+            for h, (ing, gas) in enumerate(zip(ing_fut, gas_fut), 1):
+                acumulado += ing - gas
+                resultado.append({"periodo": _sumar_meses(base, h), "ingresos": ing, "gastos": gas,
+                                  "neto": ing - gas, "acumulado": acumulado})
+        self._cache_proyeccion[clave] = (self.version_libro, resultado)
+        return resultado
+
+    def ingreso_esperado(self, periodo: str) -> float:
+        periodos, ingresos, _ = self._serie(periodo)
+        if not periodos: return 0.0
+        pasos = (int(periodo[:4]) * 12 + int(periodo[5:7])) - (int(periodos[-1][:4]) * 12 + int(periodos[-1][5:7]))
+        return self._ajustar(ingresos, [int(p[5:7]) - 1 for p in periodos], pasos)[-1]
+
+    def cierre_mes(self, anio: str, mes: str, hoy: Optional[datetime.date] = None) -> Optional[Dict]:
+        """Balance esperado al cierre del mes según la velocidad de gasto hasta hoy."""
+        hoy = hoy or datetime.date.today()
+        periodo = f"{anio}-{mes}"
+        version, ing, gas = self._mensual.get(periodo, (0, 0.0, 0.0))
+        clave = (version, hoy, self.version_libro)
+        cache = self._cache_cierre.get(periodo)
+        if cache and cache[0] == clave: return cache[1]
+        
+        inicio, fin = datetime.date(int(anio), int(mes), 1), _ultimo_dia_mes(int(anio), int(mes))
+        if hoy < inicio:
+            resultado = None
+        elif hoy > fin:
+            resultado = {"ingresos": ing, "gastos": gas, "balance": ing - gas, "dias_restantes": 0}
+        else:
+            transcurridos = (hoy - inicio).days + 1
+            restantes = (fin - hoy).days
+            gas_proy = gas + gas / transcurridos * restantes
+            ing_proy = max(ing, self.ingreso_esperado(periodo))
+            resultado = {"ingresos": ing_proy, "gastos": gas_proy, "balance": ing_proy - gas_proy,
+                         "dias_restantes": restantes}
+        self._cache_cierre[periodo] = (clave, resultado)
+        return resultado
+
+
+# =========================================================
+# MANTENIMIENTO Y ARCHIVO
+# =========================================================
+RUTA_BD = "mi_bolsillo.db"
+RUTA_ARCHIVO = "mi_bolsillo_archivo.db"
+RUTA_INSTANTANEAS = "mi_bolsillo_cache.db"
+ANIOS_EN_CALIENTE = 2
+INTERVALO_MANTENIMIENTO = 24 * 3600
+
+_mantenimiento = {"hilo": None, "lock": threading.Lock()}
+
+# Con una clave en el entorno las tres bases se abren con SQLCipher, que cifra
+# cada página por separado: una consulta por rango sólo descifra lo que lee
+VARIABLE_CLAVE = "MI_BOLSILLO_CLAVE"
+_CABECERA_SQLITE = b"SQLite format 3\x00"
+ESPERA_CIFRADO = 600
+# La frase se deriva una sola vez por proceso (PBKDF2 como SQLCipher) y las bases
+# reciben la clave cruda, así abrir una conexión no repite la derivación por base.
+# La sal se respalda junto con las bases: sin ella la clave no se puede reconstruir
+RUTA_SAL = "mi_bolsillo.sal"
+ITERACIONES_CLAVE = 256_000
+_bases_listas = set()
+
+
+def _modulo_bd():
+    """`sqlite3`, o el dbapi2 de `sqlcipher3` si hay clave configurada."""
+    if not os.environ.get(VARIABLE_CLAVE):
+        return sqlite3
+    try:
+        from sqlcipher3 import dbapi2
+    except ImportError:
+        raise RuntimeError(f"{VARIABLE_CLAVE} está definida pero falta el paquete sqlcipher3") from None
+    return dbapi2
+
+
+def _leer_sal(ruta: str = RUTA_SAL) -> bytes:
+    """Sal aleatoria de la instalación; el primer proceso la crea con un enlace atómico."""
+    if not os.path.exists(ruta):
+        temporal = f"{ruta}.{uuid.uuid4().hex}"
+        with open(temporal, "wb") as f:
+            f.write(os.urandom(16))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temporal, ruta)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporal)
+    with open(ruta, "rb") as f:
+        sal = f.read()
+    if len(sal) != 16:
+        raise RuntimeError(f"{ruta} está dañado: no se puede derivar la clave")
+    return sal
+
+
+@lru_cache(maxsize=4)
+def _clave_cruda(clave: str, sal: bytes) -> str:
+    derivada = hashlib.pbkdf2_hmac("sha512", clave.encode("utf-8"), sal, ITERACIONES_CLAVE, 32)
+    return f"x'{derivada.hex()}'"
+
+
+def _es_plana(ruta: str) -> bool:
+    if not os.path.exists(ruta):
+        return False
+    with open(ruta, "rb") as f:
+        return f.read(len(_CABECERA_SQLITE)) == _CABECERA_SQLITE
+
+
+def _abre_con(bd, ruta: str, cruda: str) -> bool:
+    conn = bd.connect(ruta)
+    try:
+        conn.execute(f'PRAGMA key = "{cruda}"')
+        conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        return True
+    except bd.DatabaseError:
+        return False
+    finally:
+        conn.close()
+
+
+def _tomar_marca(ruta: str) -> int:
+    """Marca creada en exclusiva para que un solo worker convierta cada base."""
+    marca = ruta + ".cifrando.lock"
+    while True:
+        try:
+            return os.open(marca, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                # Una marca muy vieja es de un proceso que murió a mitad
+                if time.time() - os.path.getmtime(marca) > ESPERA_CIFRADO:
+                    os.remove(marca)
+            except FileNotFoundError:
+                pass
+            time.sleep(0.1)
+
+
+def _soltar_marca(ruta: str, descriptor: int):
+    os.close(descriptor)
+    os.remove(ruta + ".cifrando.lock")
+
+
+def _cifrar_si_plana(bd, ruta: str, cruda: str):
+    """Pasa una sola vez una base plana existente al formato cifrado.
+
+    Varios workers pueden arrancar a la vez: la conversión se hace con la marca
+    tomada y la cabecera se vuelve a mirar ya con ella.
+    """
+    if not _es_plana(ruta):
+        return
+    descriptor = _tomar_marca(ruta)
+    try:
+        if not _es_plana(ruta):
+            return
+        temporal = ruta + ".cifrando"
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        plana = bd.connect(ruta)
+        try:
+            # Sin WAL pendiente: todo el contenido queda en el archivo principal
+            plana.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            plana.execute("PRAGMA journal_mode=DELETE")
+            plana.execute("ATTACH DATABASE ? AS cifrada KEY ?", (temporal, cruda))
+            # sqlcipher_export no copia auto_vacuum; sin esto el mantenimiento haría un VACUUM completo
+            plana.execute("PRAGMA cifrada.auto_vacuum = INCREMENTAL")
+            plana.execute("SELECT sqlcipher_export('cifrada')")
+            plana.execute("DETACH DATABASE cifrada")
+        finally:
+            plana.close()
+        os.replace(temporal, ruta)
+    finally:
+        _soltar_marca(ruta, descriptor)
+
+
+def _pasar_a_clave_cruda(bd, ruta: str, clave: str, cruda: str):
+    """Las bases cifradas antes con la frase directamente se recifran con la clave cruda."""
+    if not os.path.exists(ruta) or os.path.getsize(ruta) == 0 or _abre_con(bd, ruta, cruda):
+        return
+    descriptor = _tomar_marca(ruta)
+    try:
+        if _abre_con(bd, ruta, cruda):
+            return
+        conn = bd.connect(ruta)
+        try:
+            literal = clave.replace("'", "''")
+            conn.execute(f"PRAGMA key = '{literal}'")
+            # rekey no funciona en WAL; _conectar lo vuelve a activar
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.execute(f'PRAGMA rekey = "{cruda}"')
+        finally:
+            conn.close()
+    finally:
+        _soltar_marca(ruta, descriptor)
+
+
+def _preparar_cifrado(bd, rutas, clave: str) -> str:
+    """Clave cruda de las bases; cada base se convierte como mucho una vez por proceso."""
+    cruda = _clave_cruda(clave, _leer_sal())
+    for ruta in rutas:
+        if (ruta, cruda) in _bases_listas:
+            continue
+        _cifrar_si_plana(bd, ruta, cruda)
+        _pasar_a_clave_cruda(bd, ruta, clave, cruda)
+        _bases_listas.add((ruta, cruda))
+    return cruda
+
+
+def _conectar(ruta: str = RUTA_BD) -> sqlite3.Connection:
+    """Abre la base en modo WAL con la base de archivo adjunta como `archivo` y la
+    caché compartida de periodos como `instantaneas`. Si `MI_BOLSILLO_CLAVE` está
+    definida las tres quedan cifradas con esa clave."""
+    bd = _modulo_bd()
+    clave = os.environ.get(VARIABLE_CLAVE)
+    cruda = _preparar_cifrado(bd, (ruta, RUTA_ARCHIVO, RUTA_INSTANTANEAS), clave) if clave else None
+    conn = bd.connect(ruta, check_same_thread=False)
+    if cruda:
+        # PRAGMA key no admite parámetros; ATTACH sí, con KEY explícita por base
+        conn.execute(f'PRAGMA key = "{cruda}"')
+    adjuntar = "ATTACH DATABASE ? AS {} KEY ?" if cruda else "ATTACH DATABASE ? AS {}"
+    extra = (cruda,) if cruda else ()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(adjuntar.format("instantaneas"), (RUTA_INSTANTANEAS,) + extra)
+    conn.execute("PRAGMA instantaneas.journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS instantaneas.periodos (
+            libro TEXT NOT NULL,
+            periodo TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            datos TEXT NOT NULL,
+            PRIMARY KEY (libro, periodo)
+        )
+    """)
+    conn.execute(adjuntar.format("archivo"), (RUTA_ARCHIVO,) + extra)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archivo.movimientos (
+            id INTEGER PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            descripcion TEXT NOT NULL,
+            valor INTEGER NOT NULL,
+            fecha_full TEXT NOT NULL,
+            fecha_corta TEXT,
+            timestamp INTEGER NOT NULL,
+            categoria TEXT,
+            recurrente_id INTEGER,
+            moneda TEXT NOT NULL DEFAULT 'COP'
+        )
+    """)
+    if "moneda" not in [c[1] for c in conn.execute("PRAGMA archivo.table_info(movimientos)")]:
+        conn.execute("ALTER TABLE archivo.movimientos ADD COLUMN moneda TEXT NOT NULL DEFAULT 'COP'")
+    conn.execute("CREATE INDEX IF NOT EXISTS archivo.idx_archivo_timestamp ON movimientos(timestamp)")
+    conn.commit()
+    return conn
+
+
+class CacheInstantaneas:
+    """Instantáneas serializadas de un periodo compartidas entre procesos y sesiones.
+
+    Viven en `instantaneas.periodos`, un archivo SQLite aparte que todos los
+    workers adjuntan, con clave (libro, periodo) y la versión de datos con que se
+    calcularon. Sólo se guarda la última versión de cada periodo; una instantánea
+    con otra versión se ignora.
+
+    `libro` es un id aleatorio guardado en `mantenimiento` al crear la base: las
+    versiones vuelven a empezar en una base nueva, así que la ruta no basta. Como
+    `guardar` confirma la conexión, no debe compartirse con escrituras de la UI.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO mantenimiento (clave, valor) VALUES ('libro_id', ?)",
+                         (uuid.uuid4().hex,))
+        self.libro = conn.execute("SELECT valor FROM mantenimiento WHERE clave = 'libro_id'").fetchone()[0]
+
+    def leer(self, periodo: str, version: int) -> Optional[Dict]:
+        fila = self.conn.execute(
+            "SELECT datos FROM instantaneas.periodos WHERE libro = ? AND periodo = ? AND version = ?",
+            (self.libro, periodo, version)
+        ).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def guardar(self, periodo: str, version: int, datos: Dict):
+        with self.conn:
+            self.conn.execute("""
+                INSERT INTO instantaneas.periodos (libro, periodo, version, datos) VALUES (?, ?, ?, ?)
+                ON CONFLICT(libro, periodo) DO UPDATE SET version = excluded.version, datos = excluded.datos
+                WHERE excluded.version >= version
+            """, (self.libro, periodo, version, json.dumps(datos)))
+
+
+def archivar_anios_cerrados(conn: sqlite3.Connection, hoy: Optional[datetime.date] = None) -> int:
+    """Mueve los años cerrados a `archivo.movimientos` y deja su resumen mensual.
+
+    `resumen_archivado` conserva los totales por periodo, tipo y categoría, así que
+    los históricos siguen consultables sin que la tabla caliente crezca.
+    """
+    hoy = hoy or datetime.date.today()
+    corte = int(datetime.datetime(hoy.year - ANIOS_EN_CALIENTE + 1, 1, 1).timestamp())
+    if not conn.execute("SELECT 1 FROM movimientos WHERE timestamp < ? LIMIT 1", (corte,)).fetchone():
+        return 0
+    
+    # Lectura y escritura en la misma transacción con el candado de escritura tomado:
+    # otro proceso archivando a la vez espera y después ya no encuentra filas
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        archivados = _archivar_hasta(conn, corte)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return archivados
+
+
+def _archivar_hasta(conn: sqlite3.Connection, corte: int) -> int:
+    # El resumen queda en MONEDA_BASE con la tasa de cada día. Un movimiento en una
+    # moneda sin tasa se queda en caliente: su resumen no se podría corregir después
+    filtro = f"""timestamp < ? AND {SQL_TASA.format(fila="movimientos")} IS NOT NULL"""
+    conversor = ConversorMonedas(conn)
+    totales = conversor.sumar(((p, t, c), moneda, fecha, total) for p, t, c, moneda, fecha, total in conn.execute(f"""
+        SELECT substr(fecha_full,1,7), tipo, COALESCE(categoria,'OTROS'), moneda,
+               CASE WHEN moneda = ? THEN '' ELSE fecha_full END, SUM(valor)
+        FROM movimientos WHERE {filtro}
+        GROUP BY 1, 2, 3, 4, 5
+    """, (MONEDA_BASE, corte)))
+    cantidades = conn.execute(f"""
+        SELECT substr(fecha_full,1,7), tipo, COALESCE(categoria,'OTROS'), COUNT(*)
+        FROM movimientos WHERE {filtro}
+        GROUP BY 1, 2, 3
+    """, (corte,)).fetchall()
+    
+    conn.execute(f"""
+        INSERT OR IGNORE INTO archivo.movimientos
+        SELECT id, tipo, descripcion, valor, fecha_full, fecha_corta, timestamp, categoria, recurrente_id, moneda
+        FROM movimientos WHERE {filtro}
+    """, (corte,))
+    conn.executemany("""
+        INSERT INTO resumen_archivado (periodo, tipo, categoria, total, n) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(periodo, tipo, categoria) DO UPDATE SET
+            total = total + excluded.total, n = n + excluded.n
+    """, [(p, t, c, totales.get((p, t, c), 0), n) for p, t, c, n in cantidades])
+    # El trigger de borrado descuenta las estadísticas; el historial archivado
+    # debe seguir contando, así que se suma antes lo que se va a descontar
+    conn.execute(f"""
+        INSERT INTO estadisticas_categoria (categoria, n, suma, suma_cuadrados)
+        SELECT COALESCE(categoria,'OTROS'), COUNT(*), SUM(base), TOTAL(CAST(base AS REAL)*base)
+        FROM (SELECT categoria, CAST(ROUND(valor * {SQL_TASA.format(fila="movimientos")}) AS INTEGER) AS base
+              FROM movimientos WHERE tipo = 'GASTO' AND {filtro})
+        GROUP BY COALESCE(categoria,'OTROS')
+        ON CONFLICT(categoria) DO UPDATE SET n = n + excluded.n, suma = suma + excluded.suma,
+            suma_cuadrados = suma_cuadrados + excluded.suma_cuadrados
+    """, (corte,))
+    archivados = conn.execute(f"DELETE FROM movimientos WHERE {filtro}", (corte,)).rowcount
+    return archivados
+
+
+def mantenimiento_base(conn: sqlite3.Connection, forzar: bool = False) -> bool:
+    """Archiva años cerrados, actualiza estadísticas del planificador, libera páginas y
+    trunca el WAL. Sólo corre si pasó INTERVALO_MANTENIMIENTO desde la última vez."""
+    ahora = int(time.time())
+    fila = conn.execute("SELECT valor FROM mantenimiento WHERE clave = 'ultima_ejecucion'").fetchone()
+    if not forzar and fila and ahora - int(fila[0]) < INTERVALO_MANTENIMIENTO:
+        return False
+    
+    archivar_anios_cerrados(conn)
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Cambiar a vacuum incremental exige un VACUUM completo, una sola vez
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        conn.execute("PRAGMA optimize")
+    else:
+        conn.execute("ANALYZE")
+    conn.execute("PRAGMA incremental_vacuum")
+    with conn:
+        conn.execute("""
+            INSERT INTO mantenimiento (clave, valor) VALUES ('ultima_ejecucion', ?)
+            ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor
+        """, (str(ahora),))
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return True
+
+
+def _programar_mantenimiento():
+    """Un hilo por proceso corre el mantenimiento con su propia conexión: una vez al
+    arrancar (fuera de la sesión que lo pidió) y después cada INTERVALO_MANTENIMIENTO."""
+    with _mantenimiento["lock"]:
+        if _mantenimiento["hilo"] is not None: return
+        
+        def ciclo():
+            while True:
+                try:
+                    conn = _conectar()
+                    try: mantenimiento_base(conn)
+                    finally: conn.close()
+                except _modulo_bd().Error:
+                    # Base ocupada por otro worker u otro fallo: se reintenta en el próximo ciclo
+                    logging.exception("Falló el mantenimiento de la base")
+                time.sleep(INTERVALO_MANTENIMIENTO)
+        
+        _mantenimiento["hilo"] = threading.Thread(target=ciclo, name="mantenimiento", daemon=True)
+        _mantenimiento["hilo"].start()
+
+
+# =========================================================
+# REFRESCO DEL DASHBOARD
+# =========================================================
+class ProgramadorRefresco:
+    """Agrupa los pedidos de refresco de una sesión y pinta sólo el último.
+
+    Cada pedido reinicia una espera corta y no toca la base; al vencer, `resolver`
+    completa el periodo pedido con la versión de sus datos y se consulta esa clave.
+    Si mientras tanto llegó otro pedido, el resultado viejo se descarta sin
+    pintarse. Los últimos periodos consultados quedan en un LRU por clave, así
+    que volver a un mes pinta de inmediato lo último visto y sólo se repinta si
+    la versión resultó ser otra.
+    """
+
+    def __init__(self, consultar, pintar, resolver, espera: float = 0.25, capacidad: int = 6):
+        self.consultar = consultar
+        self.pintar = pintar
+        self.resolver = resolver
+        self.espera = espera
+        self.capacidad = capacidad
+        self._lock = threading.Lock()
+        self._generacion = 0
+        self._timer: Optional[threading.Timer] = None
+        self._recientes: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        # Última clave completa resuelta para cada periodo pedido
+        self._ultima: Dict[Tuple, Tuple] = {}
+
+    def _nueva_generacion(self) -> int:
+        with self._lock:
+            self._generacion += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return self._generacion
+
+    def _en_cache(self, clave: Tuple) -> Optional[Dict]:
+        with self._lock:
+            datos = self._recientes.get(clave)
+            if datos is not None: self._recientes.move_to_end(clave)
+            return datos
+
+    def _guardar(self, clave: Tuple, datos: Dict):
+        with self._lock:
+            self._recientes[clave] = datos
+            self._recientes.move_to_end(clave)
+            while len(self._recientes) > self.capacidad:
+                self._recientes.popitem(last=False)
+
+    def _ejecutar(self, periodo: Tuple, generacion: int, pintada: Optional[Tuple] = None):
+        if generacion != self._generacion: return
+        clave = self.resolver(periodo)
+        with self._lock:
+            self._ultima[periodo] = clave
+        if clave == pintada: return
+        datos = self._en_cache(clave)
+        if datos is None:
+            datos = self.consultar(clave)
+            self._guardar(clave, datos)
+        if generacion != self._generacion: return
+        self.pintar(datos)
+
+    def pedir(self, periodo: Tuple):
+        """Refresco diferido; un periodo ya visto se pinta de inmediato con lo último conocido."""
+        generacion = self._nueva_generacion()
+        with self._lock:
+            pintada = self._ultima.get(periodo)
+        datos = self._en_cache(pintada) if pintada else None
+        if datos is not None:
+            self.pintar(datos)
+        else:
+            pintada = None
+        timer = threading.Timer(self.espera, self._ejecutar, (periodo, generacion, pintada))
+        timer.daemon = True
+        with self._lock:
+            if generacion != self._generacion: return
+            self._timer = timer
+        timer.start()
+
+    def ahora(self, periodo: Tuple):
+        """Refresco inmediato que además descarta cualquier pedido pendiente."""
+        self._ejecutar(periodo, self._nueva_generacion())
 
 
 # =========================================================
@@ -135,7 +1394,7 @@ def main(page: ft.Page):
         "danger": "#ef4444", "purple": "#8b5cf6"
     }
     
-    conn = sqlite3.connect("mi_bolsillo.db", check_same_thread=False)
+    conn = _conectar()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -143,14 +1402,129 @@ def main(page: ft.Page):
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             tipo TEXT NOT NULL,
             descripcion TEXT NOT NULL,
-            valor REAL NOT NULL,
+            valor INTEGER NOT NULL,
             fecha_full TEXT NOT NULL,
             fecha_corta TEXT,
             timestamp INTEGER NOT NULL,
-            categoria TEXT
+            categoria TEXT,
+            moneda TEXT NOT NULL DEFAULT 'COP'
+        )
+    """)
+    if "recurrente_id" not in [c[1] for c in cursor.execute("PRAGMA table_info(movimientos)")]:
+        cursor.execute("ALTER TABLE movimientos ADD COLUMN recurrente_id INTEGER")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS recurrentes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            descripcion TEXT NOT NULL,
+            valor INTEGER NOT NULL,
+            categoria TEXT,
+            frecuencia TEXT NOT NULL,
+            intervalo_dias INTEGER,
+            inicio TEXT NOT NULL,
+            activo INTEGER NOT NULL DEFAULT 1,
+            moneda TEXT NOT NULL DEFAULT 'COP'
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS periodos_recurrentes (
+            periodo TEXT PRIMARY KEY,
+            hasta TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS presupuestos (
+            categoria TEXT PRIMARY KEY,
+            limite INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS versiones_periodo (
+            periodo TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tasas_cambio (
+            moneda TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            tasa REAL NOT NULL,
+            PRIMARY KEY (moneda, fecha)
+        )
+    """)
+    conn.commit()
+    _migrar_a_centavos(conn)
+    for tabla in ("movimientos", "recurrentes"):
+        if "moneda" not in [c[1] for c in cursor.execute(f"PRAGMA table_info({tabla})")]:
+            cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN moneda TEXT NOT NULL DEFAULT '{MONEDA_BASE}'")
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_timestamp ON movimientos(timestamp)")
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_movimientos_recurrente
+        ON movimientos(recurrente_id, fecha_full) WHERE recurrente_id IS NOT NULL
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_duplicado ON movimientos(descripcion, valor, timestamp)")
+    if cursor.execute("SELECT COUNT(*) FROM versiones_periodo").fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO versiones_periodo (periodo, version)
+            SELECT DISTINCT substr(fecha_full,1,7), 1 FROM movimientos
+        """)
+    for evento, fila in (("INSERT", "NEW"), ("DELETE", "OLD"), ("UPDATE", "NEW")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_version_{evento.lower()} AFTER {evento} ON movimientos
+            BEGIN
+                INSERT INTO versiones_periodo (periodo, version) VALUES (substr({fila}.fecha_full,1,7), 1)
+                ON CONFLICT(periodo) DO UPDATE SET version = version + 1;
+            END
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS estadisticas_categoria (
+            categoria TEXT PRIMARY KEY,
+            n INTEGER NOT NULL,
+            suma INTEGER NOT NULL,
+            suma_cuadrados REAL NOT NULL
+        )
+    """)
+    # Los triggers anteriores contaban 1:1 lo que no tenía tasa: se reemplazan y se recalcula
+    recalcular = (cursor.execute("SELECT COUNT(*) FROM estadisticas_categoria").fetchone()[0] == 0
+                  or not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'trg_estadisticas_tasa_insert'").fetchone())
+    # Las estadísticas se llevan en MONEDA_BASE con la tasa del día del movimiento
+    for evento, fila, signo in (("INSERT", "NEW", 1), ("DELETE", "OLD", -1)):
+        base = f"CAST(ROUND({fila}.valor * {SQL_TASA.format(fila=fila)}) AS INTEGER)"
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_estadisticas_{evento.lower()}")
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_estadisticas_moneda_{evento.lower()}")
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_estadisticas_tasa_{evento.lower()} AFTER {evento} ON movimientos
+            WHEN {fila}.tipo = 'GASTO' AND {SQL_TASA.format(fila=fila)} IS NOT NULL
+            BEGIN
+                INSERT INTO estadisticas_categoria (categoria, n, suma, suma_cuadrados)
+                VALUES (COALESCE({fila}.categoria,'OTROS'), {signo}, {signo}*{base},
+                        {signo}*CAST({base} AS REAL)*{base})
+                ON CONFLICT(categoria) DO UPDATE SET n = n + excluded.n, suma = suma + excluded.suma,
+                    suma_cuadrados = suma_cuadrados + excluded.suma_cuadrados;
+            END
+        """)
+    if recalcular:
+        reconstruir_estadisticas(conn)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_archivado (
+            periodo TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (periodo, tipo, categoria)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mantenimiento (
+            clave TEXT PRIMARY KEY,
+            valor TEXT NOT NULL
         )
     """)
     conn.commit()
+    cargar_tasas(conn)
+    _programar_mantenimiento()
     
     hoy = datetime.datetime.now()
     estado = {
@@ -161,6 +1535,16 @@ def main(page: ft.Page):
     }
     
     motor_ia = MotorIA()
+    conversor = ConversorMonedas(conn)
+    # Conexión propia para el refresco del dashboard, que corre en el hilo del
+    # temporizador: sus commits nunca tocan una escritura a medias de la UI
+    conn_lectura = _conectar()
+    lock_lectura = threading.Lock()
+    instantaneas = CacheInstantaneas(conn_lectura)
+    presupuestos = ControlPresupuestos(conn, conversor)
+    pronostico = MotorPronostico()
+    detector = DetectorAnomalias(conn, conversor)
+    cache = {"libro": None}
     
     # =========================================================
     # FUNCIONES AUXILIARES
@@ -182,6 +1566,20 @@ def main(page: ft.Page):
         page.snack_bar.open = True
         page.update()
     
+    def obtener_libro() -> LibroColumnar:
+        # Cualquier escritura, de esta sesión o de otro proceso, sube la suma de versiones
+        libro = cache["libro"]
+        version = conn.execute("SELECT COALESCE(SUM(version),0) FROM versiones_periodo").fetchone()[0]
+        if libro is None or sum(libro.versiones.values()) != version:
+            cache["libro"] = libro = LibroColumnar.cargar(conn, conversor)
+        return libro
+    
+    def preparar_periodo(anio: str, mes: str):
+        if materializar_recurrentes(conn, anio, mes):
+            cache["libro"] = None
+            presupuestos.invalidar(anio, mes)
+            detector.invalidar()
+    
     def crear_boton(texto, icono, on_click, color=COLORES["primary"], expand=False):
         return ft.Container(
             expand=expand, padding=ft.padding.symmetric(horizontal=20, vertical=12),
@@ -261,7 +1659,9 @@ def main(page: ft.Page):
     def aplicar_filtros(e):
         estado["mes"] = dropdown_mes.value
         estado["dia"] = txt_filtro_dia.value.strip().zfill(2) if txt_filtro_dia.value and txt_filtro_dia.value.isdigit() else ""
-        cargar_dashboard()
+        refresco.pedir((estado["anio"], estado["mes"], estado["dia"]))
+    
+    dropdown_mes.on_change = aplicar_filtros
     
     barra_filtros = ft.Container(
         margin=ft.margin.only(left=16, right=16, top=8, bottom=8),
@@ -325,12 +1725,68 @@ def main(page: ft.Page):
         text_size=14, height=52
     )
     
+    dropdown_moneda = ft.Dropdown(
+        value=MONEDA_BASE, width=100,
+        bgcolor=COLORES["input"], color=COLORES["text"],
+        border_radius=12, border_color=ft.colors.TRANSPARENT,
+        text_size=14, height=52,
+        options=[ft.dropdown.Option(m, m) for m in conversor.monedas]
+    )
+    
+    dropdown_frecuencia = ft.Dropdown(
+        value="UNICO", expand=True,
+        bgcolor=COLORES["input"], color=COLORES["text"],
+        border_radius=12, border_color=ft.colors.TRANSPARENT,
+        text_size=14, height=52,
+        options=[
+            ft.dropdown.Option("UNICO", "Una vez"),
+            ft.dropdown.Option("MENSUAL", "🔁 Mensual"),
+            ft.dropdown.Option("QUINCENAL", "🔁 Cada 2 semanas"),
+            ft.dropdown.Option("DIAS", "🔁 Cada N días")
+        ]
+    )
+    
+    txt_intervalo = ft.TextField(
+        hint_text="Días", width=80,
+        bgcolor=COLORES["input"], color=COLORES["text"],
+        border_radius=12, border_color=ft.colors.TRANSPARENT,
+        keyboard_type=ft.KeyboardType.NUMBER, text_size=14, height=52
+    )
+    
+    def guardar_recurrente(tipo, desc, valor, cat, frecuencia, moneda):
+        intervalo = None
+        if frecuencia == "DIAS":
+            if not (txt_intervalo.value or "").strip().isdigit() or int(txt_intervalo.value) <= 0:
+                toast("⚠️ Indica cada cuántos días se repite", COLORES["warning"])
+                return
+            intervalo = int(txt_intervalo.value)
+        
+        hoy_fecha = datetime.date.today()
+        cursor.execute("""
+            INSERT INTO recurrentes (tipo, descripcion, valor, categoria, frecuencia, intervalo_dias, inicio, moneda)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (tipo, desc, valor, cat, frecuencia, intervalo, hoy_fecha.isoformat(), moneda))
+        conn.commit()
+        if materializar_regla(conn, cursor.lastrowid):
+            presupuestos.invalidar(str(hoy_fecha.year), str(hoy_fecha.month).zfill(2))
+            detector.invalidar()
+        preparar_periodo(str(hoy_fecha.year), str(hoy_fecha.month).zfill(2))
+        
+        txt_valor.value = ""
+        txt_descripcion.value = ""
+        txt_categoria.value = ""
+        txt_intervalo.value = ""
+        dropdown_frecuencia.value = "UNICO"
+        
+        toast("🔁 Movimiento recurrente creado", COLORES["success"])
+        cargar_dashboard()
+    
     def guardar_movimiento(e):
         try:
             if not txt_valor.value:
                 toast("⚠️ Ingresa un valor", COLORES["warning"])
                 return
-            valor = float(txt_valor.value.replace(",", ""))
+            valor = _a_centavos(txt_valor.value)
             if valor <= 0:
                 toast("⚠️ El valor debe ser mayor a 0", COLORES["warning"])
                 return
@@ -338,21 +1794,45 @@ def main(page: ft.Page):
             desc = (txt_descripcion.value or "SIN DESCRIPCIÓN").strip().upper()
             tipo = dropdown_tipo.value
             cat = (txt_categoria.value or "OTROS").strip().upper()
+            moneda = dropdown_moneda.value or MONEDA_BASE
+            
+            if dropdown_frecuencia.value in FRECUENCIAS_RECURRENTES:
+                guardar_recurrente(tipo, desc, valor, cat, dropdown_frecuencia.value, moneda)
+                return
             
             ahora = datetime.datetime.now()
+            ts = int(ahora.timestamp())
+            valor_base = conversor.convertir(valor, moneda, ahora.strftime("%Y-%m-%d"))
+            avisos = detector.revisar(tipo, desc, valor, cat, ahora, moneda)
             cursor.execute("""
                 INSERT INTO movimientos 
-                (tipo, descripcion, valor, fecha_full, fecha_corta, timestamp, categoria)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                (tipo, descripcion, valor, fecha_full, fecha_corta, timestamp, categoria, moneda)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             """, (tipo, desc, valor, ahora.strftime("%Y-%m-%d"),
-                  ahora.strftime("%d/%m"), int(ahora.timestamp()), cat))
+                  ahora.strftime("%d/%m"), ts, cat, moneda))
             conn.commit()
+            libro = cache["libro"]
+            if libro is not None:
+                # Si nadie más escribió, el alta propia se agrega sin recargar el libro
+                versiones = LibroColumnar.leer_versiones(conn)
+                if sum(versiones.values()) == sum(libro.versiones.values()) + 1:
+                    libro.agregar(ts, tipo, valor_base, cat)
+                    libro.versiones = versiones
+                else:
+                    cache["libro"] = None
+            if tipo == "GASTO":
+                detector.registrar(valor_base, cat, ahora)
+                alerta = presupuestos.registrar(str(ahora.year), str(ahora.month).zfill(2), cat, valor_base)
+                if alerta: avisos.insert(0, alerta)
             
             txt_valor.value = ""
             txt_descripcion.value = ""
             txt_categoria.value = ""
             
-            toast("✅ Movimiento agregado", COLORES["success"])
+            if avisos:
+                toast(" · ".join(avisos[:2]), COLORES["warning"])
+            else:
+                toast("✅ Movimiento agregado", COLORES["success"])
             cargar_dashboard()
         except ValueError:
             toast("❌ Valor inválido", COLORES["danger"])
@@ -367,7 +1847,9 @@ def main(page: ft.Page):
             ft.Text("📝 Nuevo Movimiento", size=18, weight=ft.FontWeight.BOLD, color=COLORES["text"]),
             txt_descripcion,
             ft.Row([dropdown_tipo, txt_categoria], spacing=8),
+            ft.Row([dropdown_frecuencia, txt_intervalo], spacing=8),
             ft.Row([
+                dropdown_moneda,
                 txt_valor,
                 ft.Container(
                     width=52, height=52, bgcolor=COLORES["primary"], border_radius=16,
@@ -385,8 +1867,15 @@ def main(page: ft.Page):
     
     def eliminar_movimiento(mov_id):
         def confirmar(e):
+            fila = cursor.execute("SELECT tipo, valor, fecha_full, categoria, moneda FROM movimientos WHERE id = ?",
+                                  (mov_id,)).fetchone()
             cursor.execute("DELETE FROM movimientos WHERE id = ?", (mov_id,))
             conn.commit()
+            cache["libro"] = None
+            detector.invalidar()
+            if fila and fila[0] == "GASTO":
+                presupuestos.revertir(fila[2][:4], fila[2][5:7], fila[3] or "OTROS",
+                                      conversor.convertir(fila[1], fila[4], fila[2]))
             toast("🗑️ Eliminado", COLORES["success"])
             cargar_dashboard()
             dlg.open = False
@@ -410,6 +1899,34 @@ def main(page: ft.Page):
         dlg.open = True
         page.update()
     
+    def detener_recurrente(rid):
+        def confirmar(e):
+            if pausar_recurrente(conn, rid):
+                toast("⏸️ Ya no se repetirá", COLORES["success"])
+            else:
+                toast("Esta repetición ya estaba detenida", COLORES["warning"])
+            dlg.open = False
+            page.update()
+        
+        def cancelar(e):
+            dlg.open = False
+            page.update()
+        
+        dlg = ft.AlertDialog(
+            title=ft.Text("Confirmar", color=COLORES["text"], weight=ft.FontWeight.BOLD),
+            content=ft.Text("¿Dejar de repetir este movimiento? Los ya registrados se conservan.",
+                            color=COLORES["text_secondary"]),
+            bgcolor=COLORES["bg_secondary"], shape=ft.RoundedRectangleBorder(radius=16),
+            actions=[
+                ft.TextButton("Cancelar", on_click=cancelar),
+                ft.TextButton("Detener", on_click=confirmar, style=ft.ButtonStyle(color=COLORES["warning"]))
+            ],
+            actions_alignment=ft.MainAxisAlignment.END
+        )
+        page.dialog = dlg
+        dlg.open = True
+        page.update()
+    
     # =========================================================
     # VISTA IA
     # =========================================================
@@ -437,25 +1954,24 @@ def main(page: ft.Page):
         columna_ia.controls.clear()
         
         mes, anio = estado["mes"], estado["anio"]
+        mes_ant = str(int(mes)-1).zfill(2) if int(mes) > 1 else "12"
+        anio_ant = anio if int(mes) > 1 else str(int(anio)-1)
+        preparar_periodo(anio, mes)
+        preparar_periodo(anio_ant, mes_ant)
+        libro = obtener_libro()
         
-        cursor.execute("""
-            SELECT tipo, COALESCE(SUM(valor), 0) 
-            FROM movimientos WHERE substr(fecha_full,1,4)=? AND substr(fecha_full,6,2)=?
-            GROUP BY tipo
-        """, (anio, mes))
-        datos = {t: float(v) for t, v in cursor.fetchall()}
-        ing, gas = datos.get("INGRESO", 0), datos.get("GASTO", 0)
+        i, j = libro.rango_mes(anio, mes)
+        ing, gas = libro.totales(i, j)
         balance = ing - gas
         
-        cursor.execute("SELECT COALESCE(SUM(ahorrado_actual),0) FROM ahorros")
-        ahorros = float(cursor.fetchone()[0] or 0)
+        ahorros = _ahorros_centavos(conn)
         
-        cursor.execute("""
-            SELECT categoria, SUM(valor)
-            FROM movimientos WHERE tipo='GASTO' AND substr(fecha_full,1,4)=? AND substr(fecha_full,6,2)=?
-            GROUP BY categoria ORDER BY SUM(valor) DESC
-        """, (anio, mes))
-        categorias = {c: float(v) for c, v in cursor.fetchall()}
+        categorias = libro.gastos_por_categoria(i, j)
+        
+        pronostico.sincronizar(libro)
+        periodo_actual = datetime.date.today().strftime("%Y-%m")
+        cierre = pronostico.cierre_mes(anio, mes)
+        proyeccion = pronostico.proyeccion(periodo_actual)
         
         score = motor_ia.calcular_score_financiero(ing, gas, ahorros, 0)
         
@@ -504,14 +2020,7 @@ def main(page: ft.Page):
             )
         )
         
-        mes_ant = str(int(mes)-1).zfill(2) if int(mes) > 1 else "12"
-        anio_ant = anio if int(mes) > 1 else str(int(anio)-1)
-        cursor.execute("""
-            SELECT tipo, COALESCE(SUM(valor), 0) 
-            FROM movimientos WHERE substr(fecha_full,1,4)=? AND substr(fecha_full,6,2)=?
-            GROUP BY tipo
-        """, (anio_ant, mes_ant))
-        ant = {t: float(v) for t, v in cursor.fetchall()}
+        ing_ant, gas_ant = libro.totales(*libro.rango_mes(anio_ant, mes_ant))
         
         columna_ia.controls.append(
             ft.Container(
@@ -527,7 +2036,7 @@ def main(page: ft.Page):
                     ]),
                     ft.Container(height=8),
                     ft.Text(
-                        motor_ia.generar_comparacion_mes_anterior(ing, gas, ant.get("INGRESO",0), ant.get("GASTO",0)),
+                        motor_ia.generar_comparacion_mes_anterior(ing, gas, ing_ant, gas_ant),
                         size=14, color=COLORES["text_secondary"]
                     )
                 ])
@@ -535,7 +2044,8 @@ def main(page: ft.Page):
         )
         
         metas = [{"nombre": m[0]} for m in cursor.execute("SELECT nombre FROM ahorros").fetchall()]
-        alertas = motor_ia.generar_alertas_personalizadas(ing, gas, ahorros, 0, metas)
+        alertas = motor_ia.generar_alertas_personalizadas(ing, gas, ahorros, 0, metas,
+                                                          presupuestos.alertas(anio, mes))
         if alertas:
             columna_ia.controls.append(
                 ft.Container(
@@ -558,6 +2068,28 @@ def main(page: ft.Page):
                 )
             )
         
+        anomalias = detector.anomalias_periodo(libro, anio, mes)
+        if anomalias:
+            columna_ia.controls.append(
+                ft.Container(
+                    padding=20, bgcolor=COLORES["card"], border_radius=16,
+                    border=ft.border.all(1, COLORES["warning"]), margin=ft.margin.only(bottom=8),
+                    content=ft.Column([
+                        ft.Row([
+                            ft.Container(
+                                width=40, height=40, bgcolor=f"{COLORES['warning']}20", border_radius=20,
+                                content=ft.Text("🔎", size=20, color=COLORES["warning"], text_align="center"),
+                            ),
+                            ft.Text("Movimientos inusuales", size=18, weight=ft.FontWeight.BOLD, color=COLORES["text"])
+                        ]),
+                        ft.Container(height=8),
+                        ft.Column([
+                            ft.Text(a, size=13, color=COLORES["text_secondary"]) for a in anomalias
+                        ], spacing=8)
+                    ])
+                )
+            )
+        
         cats = motor_ia.analizar_categorias_gastos(categorias, gas)
         if cats:
             columna_ia.controls.append(
@@ -631,7 +2163,7 @@ def main(page: ft.Page):
                         ),
                         ft.Column([
                             ft.Text("Meta para el próximo mes", size=18, weight=ft.FontWeight.BOLD, color="white"),
-                            ft.Text(motor_ia.generar_meta_proximo_mes(ing, gas, ahorros), 
+                            ft.Text(motor_ia.generar_meta_proximo_mes(ing, gas, ahorros, proyeccion), 
                                    size=14, color="#ffffffdd")
                         ], spacing=4)
                     ], spacing=16)
@@ -639,8 +2171,84 @@ def main(page: ft.Page):
             )
         )
         
+        if cierre or proyeccion:
+            lineas = []
+            if cierre and cierre["dias_restantes"] > 0:
+                lineas.append(f"Cierre estimado del mes: {_fmt_money(cierre['balance'])} "
+                              f"(gastos proyectados {_fmt_money(cierre['gastos'])})")
+            elif cierre:
+                lineas.append(f"Cierre del mes: {_fmt_money(cierre['balance'])}")
+            for meses in (3, 6, 12):
+                if len(proyeccion) >= meses:
+                    lineas.append(f"Ahorro proyectado a {meses} meses: {_fmt_money(proyeccion[meses - 1]['acumulado'])}")
+            columna_ia.controls.append(
+                ft.Container(
+                    padding=20, bgcolor=COLORES["card"], border_radius=16,
+                    border=ft.border.all(1, COLORES["border"]), margin=ft.margin.only(bottom=16),
+                    content=ft.Column([
+                        ft.Row([
+                            ft.Container(
+                                width=40, height=40, bgcolor=f"{COLORES['primary']}20", border_radius=20,
+                                content=ft.Text("🔮", size=20, color=COLORES["primary"], text_align="center"),
+                            ),
+                            ft.Text("Proyecciones", size=18, weight=ft.FontWeight.BOLD, color=COLORES["text"])
+                        ]),
+                        ft.Container(height=8),
+                        ft.Column([
+                            ft.Text(l, size=13, color=COLORES["text_secondary"]) for l in lineas
+                        ], spacing=8)
+                    ])
+                )
+            )
+        
         page.update()
     
+    # =========================================================
+    # PRESUPUESTOS
+    # =========================================================
+    txt_presupuesto_categoria = ft.TextField(
+        hint_text="Categoría", expand=True,
+        bgcolor=COLORES["input"], color=COLORES["text"],
+        border_radius=12, border_color=ft.colors.TRANSPARENT,
+        focused_border_color=COLORES["primary"],
+        text_size=14, height=48
+    )
+    
+    txt_presupuesto_limite = ft.TextField(
+        hint_text="$ Límite mensual", expand=True,
+        bgcolor=COLORES["input"], color=COLORES["text"],
+        border_radius=12, border_color=ft.colors.TRANSPARENT,
+        focused_border_color=COLORES["primary"],
+        keyboard_type=ft.KeyboardType.NUMBER, text_size=14, height=48
+    )
+    
+    def guardar_presupuesto(e):
+        try:
+            cat = (txt_presupuesto_categoria.value or "").strip().upper()
+            if not cat:
+                toast("⚠️ Ingresa una categoría", COLORES["warning"])
+                return
+            limite = _a_centavos(txt_presupuesto_limite.value or "")
+            if limite <= 0:
+                toast("⚠️ El límite debe ser mayor a 0", COLORES["warning"])
+                return
+            presupuestos.definir(cat, limite)
+            txt_presupuesto_categoria.value = ""
+            txt_presupuesto_limite.value = ""
+            toast(f"✅ Presupuesto de {cat}: {_fmt_money(limite)}", COLORES["success"])
+        except ValueError:
+            toast("❌ Límite inválido", COLORES["danger"])
+    
+    card_presupuestos = ft.Container(
+        padding=20, bgcolor=COLORES["card"], border_radius=16,
+        border=ft.border.all(1, COLORES["border"]), margin=ft.margin.only(bottom=16),
+        content=ft.Column([
+            ft.Text("📐 Presupuestos por categoría", size=16, weight=ft.FontWeight.BOLD, color=COLORES["text"]),
+            ft.Row([txt_presupuesto_categoria, txt_presupuesto_limite], spacing=8),
+            crear_boton("Guardar presupuesto", "💾", guardar_presupuesto)
+        ], spacing=12)
+    )
+    
     # =========================================================
     # VISTA IA CON BOTÓN
     # =========================================================
@@ -675,6 +2283,7 @@ def main(page: ft.Page):
                             )
                         ], horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=8)
                     ),
+                    card_presupuestos,
                     columna_ia
                 ])
             ),
@@ -685,35 +2294,90 @@ def main(page: ft.Page):
     # =========================================================
     # CARGAR DASHBOARD
     # =========================================================
-    def cargar_dashboard():
-        lista_movimientos.controls.clear()
+    def clave_dashboard(periodo: Tuple) -> Tuple:
+        # Corre ya pasada la espera del refresco, con la conexión de lectura
+        anio, mes, dia = periodo
+        with lock_lectura:
+            if materializar_recurrentes(conn_lectura, anio, mes):
+                presupuestos.invalidar(anio, mes)
+                detector.invalidar()
+            # Versión y firma de tasas en una sola lectura: si otro worker recargó las
+            # tasas, la instantánea de esta versión debe calcularse con las nuevas
+            while True:
+                firma, version = conn_lectura.execute("""
+                    SELECT (SELECT valor FROM mantenimiento WHERE clave = 'tasas_firma'),
+                           (SELECT version FROM versiones_periodo WHERE periodo = ?)
+                """, (f"{anio}-{mes}",)).fetchone()
+                if firma == conversor.firma: break
+                conversor.recargar(conn_lectura)
+        return (anio, mes, dia, version or 0)
+    
+    def resumir_periodo(desde: int, hasta: int) -> Dict:
+        # Totales y categorías agregados por tipo, moneda y día en SQL; sólo se convierte cada grupo
+        sumas = conversor.sumar(((t, c), m, f, v) for t, c, m, f, v in conn_lectura.execute("""
+            SELECT tipo, COALESCE(categoria,'OTROS'), moneda, CASE WHEN moneda = ? THEN '' ELSE fecha_full END, SUM(valor)
+            FROM (
+                SELECT tipo, categoria, moneda, fecha_full, valor FROM movimientos WHERE timestamp >= ? AND timestamp < ?
+                UNION ALL
+                SELECT tipo, categoria, moneda, fecha_full, valor FROM archivo.movimientos WHERE timestamp >= ? AND timestamp < ?
+            ) GROUP BY 1, 2, 3, 4
+        """, (MONEDA_BASE, desde, hasta, desde, hasta)))
+        ingresos = sum(v for (t, _), v in sumas.items() if t == "INGRESO")
+        categorias = {c: v for (t, c), v in sumas.items() if t == "GASTO"}
+        gastos = sum(categorias.values())
         
-        mes, anio, dia = estado["mes"], estado["anio"], estado["dia"]
-        query = """
-            SELECT id, tipo, descripcion, valor, fecha_corta, categoria
-            FROM movimientos
-            WHERE substr(fecha_full,1,4)=? AND substr(fecha_full,6,2)=?
-        """
-        params = [anio, mes]
-        if dia:
-            query += " AND substr(fecha_full,9,2)=?"
-            params.append(dia)
-        query += " ORDER BY timestamp DESC"
+        ahorros = _ahorros_centavos(conn_lectura)
+        
+        return {"ingresos": ingresos, "gastos": gastos, "categorias": categorias, "ahorros": ahorros,
+                "score": motor_ia.calcular_score_financiero(ingresos, gastos, ahorros, 0)}
+    
+    def consultar_dashboard(clave: Tuple) -> Dict:
+        # Corre en el hilo del temporizador o en el de la UI (ahora): una a la vez
+        with lock_lectura:
+            return _consultar_dashboard(clave)
+    
+    def _consultar_dashboard(clave: Tuple) -> Dict:
+        anio, mes, dia, version = clave
+        desde, hasta = _limites_dia(anio, mes, dia) if dia else _limites_mes(int(anio), int(mes))
         
-        cursor.execute(query, params)
-        movs = cursor.fetchall()
+        movs = conn_lectura.execute("""
+            SELECT id, tipo, descripcion, valor, fecha_corta, categoria, moneda, timestamp, 0, recurrente_id FROM movimientos
+            WHERE timestamp >= ? AND timestamp < ?
+            UNION ALL
+            SELECT id, tipo, descripcion, valor, fecha_corta, categoria, moneda, timestamp, 1, recurrente_id FROM archivo.movimientos
+            WHERE timestamp >= ? AND timestamp < ?
+            ORDER BY 8 DESC
+        """, (desde, hasta, desde, hasta)).fetchall()
         
-        ing_total = gas_total = 0
+        if dia:
+            return {"movs": movs, **resumir_periodo(desde, hasta)}
+        # El mes completo se comparte entre sesiones y workers por su versión de datos
+        periodo = f"{anio}-{mes}"
+        resumen = instantaneas.leer(periodo, version)
+        if resumen is None:
+            resumen = resumir_periodo(desde, hasta)
+            instantaneas.guardar(periodo, version, resumen)
+        else:
+            # Los ahorros no llevan versión de periodo: si cambiaron sólo se recalcula el score
+            ahorros = _ahorros_centavos(conn_lectura)
+            if ahorros != resumen["ahorros"]:
+                resumen["ahorros"] = ahorros
+                resumen["score"] = motor_ia.calcular_score_financiero(resumen["ingresos"], resumen["gastos"], ahorros, 0)
+                instantaneas.guardar(periodo, version, resumen)
+        return {"movs": movs, **resumen}
+    
+    def pintar_dashboard(datos: Dict):
+        lista_movimientos.controls.clear()
+        
+        movs = datos["movs"]
+        ing_total, gas_total = datos["ingresos"], datos["gastos"]
         
         for mov in movs:
-            mid, tipo, desc, val, fecha, cat = mov
-            val = float(val)
+            mid, tipo, desc, val, fecha, cat, moneda, _, archivado, rid = mov
             
             if tipo == "INGRESO":
-                ing_total += val
                 color, icono, signo = COLORES["success"], "💰", "+"
             else:
-                gas_total += val
                 color, icono, signo = COLORES["danger"], "💸", "-"
             
             lista_movimientos.controls.append(
@@ -743,12 +2407,17 @@ def main(page: ft.Page):
                             ], spacing=4)
                         ], spacing=12),
                         ft.Row([
-                            ft.Text(f"{signo}{_fmt_money(val)}", size=16, weight=ft.FontWeight.BOLD, color=color),
+                            ft.Text(f"{signo}{_fmt_money(val, moneda)}", size=16, weight=ft.FontWeight.BOLD, color=color),
+                            ft.Container(
+                                width=36, height=36, bgcolor=f"{COLORES['warning']}20", border_radius=10,
+                                on_click=lambda e, rid=rid: detener_recurrente(rid), ink=True,
+                                content=ft.Text("⏸️", size=16, color=COLORES["warning"], text_align="center"),
+                            ) if rid and not archivado else ft.Container(),
                             ft.Container(
                                 width=36, height=36, bgcolor=f"{COLORES['danger']}20", border_radius=10,
                                 on_click=lambda e, mid=mid: eliminar_movimiento(mid), ink=True,
                                 content=ft.Text("🗑️", size=16, color=COLORES["danger"], text_align="center"),
-                            )
+                            ) if not archivado else ft.Text("🗄️", size=16, color=COLORES["text_disabled"])
                         ], spacing=8)
                     ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
                 )
@@ -770,21 +2439,27 @@ def main(page: ft.Page):
                 )
             )
         
+        if conversor.faltantes:
+            toast(f"⚠️ Sin tasa de cambio para {', '.join(sorted(conversor.faltantes))}: no se suma a los totales", COLORES["warning"])
+            conversor.faltantes.clear()
+        
         balance = ing_total - gas_total
         txt_ingresos.value = _fmt_money(ing_total)
         txt_gastos.value = _fmt_money(gas_total)
         txt_balance.value = _fmt_money(balance)
         
-        cursor.execute("SELECT COALESCE(SUM(ahorrado_actual),0) FROM ahorros")
-        ahorros = float(cursor.fetchone()[0] or 0)
-        
-        score = motor_ia.calcular_score_financiero(ing_total, gas_total, ahorros, 0)
+        score = datos["score"]
         txt_score.value = f"{score['score']}"
         txt_nivel.value = score["nivel"]
         txt_emoji_score.value = score["emoji"]
         
         page.update()
     
+    refresco = ProgramadorRefresco(consultar_dashboard, pintar_dashboard, clave_dashboard)
+    
+    def cargar_dashboard():
+        refresco.ahora((estado["anio"], estado["mes"], estado["dia"]))
+    
     # =========================================================
     # VISTAS
     # =========================================================